@@ -0,0 +1,49 @@
+"""Compare cartopy and closed form web mercator projections
+
+Usage: python bench_geo.py
+"""
+import sys
+import time
+import cartopy
+import numpy as np
+import geo
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def cartopy_web_mercator(lons, lats):
+    return geo.transform(
+        lons,
+        lats,
+        cartopy.crs.PlateCarree(),
+        cartopy.crs.Mercator.GOOGLE)
+
+
+def main(argv):
+    random = np.random.RandomState(0)
+    fmt = "{:>10} {:>16}: {:10.3f} ms"
+    for size in [2, 100, 10**4, 10**6]:
+        lons = random.uniform(-180., 180., size)
+        lats = random.uniform(-85., 85., size)
+        lons32 = lons.astype(np.float32)
+        lats32 = lats.astype(np.float32)
+        out = np.empty(size), np.empty(size)
+        repeat = 5 if size > 10**4 else 50
+        cases = [
+            ("cartopy", lambda: cartopy_web_mercator(lons, lats)),
+            ("numpy float64", lambda: geo.web_mercator(lons, lats)),
+            ("numpy float32", lambda: geo.web_mercator(lons32, lats32)),
+            ("numpy out=", lambda: geo.web_mercator(lons, lats, out=out))]
+        for name, fn in cases:
+            print(fmt.format(size, name, 1000 * np.median(timed(fn, repeat))))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
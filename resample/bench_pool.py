@@ -0,0 +1,65 @@
+"""Compare first-read and repeat-read latency with and without DatasetPool
+
+Usage: python bench_pool.py [PATH VARIABLE]
+
+Without arguments a temporary file is generated
+"""
+import sys
+import os
+import time
+import tempfile
+import netCDF4
+import numpy as np
+from pool import DatasetPool
+
+
+def read_direct(path, variable):
+    with netCDF4.Dataset(path) as dataset:
+        return dataset.variables[variable][0]
+
+
+def read_pooled(datasets, path, variable):
+    with datasets.dataset(path) as dataset:
+        return dataset.variables[variable][0]
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def sample_file(directory):
+    path = os.path.join(directory, "sample.nc")
+    with netCDF4.Dataset(path, "w") as dataset:
+        dataset.createDimension("time", 8)
+        dataset.createDimension("latitude", 500)
+        dataset.createDimension("longitude", 500)
+        var = dataset.createVariable(
+            "air_temperature", "f4", ("time", "latitude", "longitude"))
+        var[:] = np.random.rand(8, 500, 500)
+    return path, "air_temperature"
+
+
+def main(argv):
+    if len(argv) == 2:
+        path, variable = argv
+    else:
+        path, variable = sample_file(tempfile.mkdtemp())
+    repeat = 20
+    direct = timed(lambda: read_direct(path, variable), repeat)
+    datasets = DatasetPool()
+    pooled = timed(lambda: read_pooled(datasets, path, variable), repeat)
+    fmt = "{:>8} first: {:8.2f} ms  repeat (median): {:8.2f} ms"
+    for name, times in [("direct", direct), ("pooled", pooled)]:
+        print(fmt.format(
+            name,
+            1000 * times[0],
+            1000 * np.median(times[1:])))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,97 @@
+"""Per-session CPU cost of sending one image to many documents
+
+Each simulated session owns a document showing the same image.
+Encoding the image and the PATCH-DOC serialisation the server
+performs for each session are timed. Sessions either share one
+cache, so encodings are computed once, or each have their own
+cache holding the raw image and its summary, so each session
+encodes its own copy
+
+Usage: python bench_sessions.py [SESSIONS] [SIZE]
+"""
+import sys
+import time
+import numpy as np
+import bokeh.document
+import bokeh.models
+import bokeh.plotting
+from bokeh.protocol.messages.patch_doc import process_document_events
+import cache
+import summary
+import view
+
+
+def image(size):
+    random = np.random.RandomState(0)
+    values = random.normal(size=(size, size)).astype(np.float32)
+    values[:size // 8] = np.nan
+    return {
+        "x": [0.],
+        "y": [0.],
+        "dw": [float(size)],
+        "dh": [float(size)],
+        "image": [values]
+    }
+
+
+def images(data):
+    result = cache.ImageCache()
+    result["key"] = data
+    result.derive("key", "summary", lambda: summary.summarise(data["image"]))
+    return result
+
+
+def session(mode, images, viewport):
+    color_mapper = bokeh.models.LinearColorMapper(
+            palette="Viridis256", low=-3, high=3)
+    source = bokeh.models.ColumnDataSource({
+        "x": [], "y": [], "dw": [], "dh": [], "image": []})
+    encoder = view.Encoder(source, color_mapper, mode, images)
+    if viewport is not None:
+        encoder.zoom(*viewport)
+    figure = bokeh.plotting.figure()
+    encoder.add_figure(figure)
+    document = bokeh.document.Document()
+    document.add_root(figure)
+    events = []
+    document.on_change(events.append)
+    return encoder, events
+
+
+def run(sessions, mode, data, shared, viewport=None):
+    common = images(data)
+    clients = [session(mode, common if shared else images(data), viewport)
+               for _ in range(sessions)]
+    times = []
+    for encoder, events in clients:
+        start = time.perf_counter()
+        encoder.set(data, "key")
+        process_document_events(events)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main(argv):
+    sessions = int(argv[0]) if len(argv) > 0 else 50
+    size = int(argv[1]) if len(argv) > 1 else 1000
+    data = image(size)
+    box = (0.4 * size, 0.4 * size, 0.6 * size, 0.6 * size)
+    viewports = [("full", None), ("zoomed", (box, 1.))]
+    fmt = ("{:>8} {:>7} {:>7}: "
+           "first {:7.2f} ms, median {:7.2f} ms, total {:8.1f} ms")
+    for mode in ["float32", "uint8", "uint16", "rgba"]:
+        for name, viewport in viewports:
+            for shared in [False, True]:
+                times = 1000 * np.array(
+                    run(sessions, mode, data, shared, viewport))
+                print(fmt.format(
+                    mode,
+                    name,
+                    "shared" if shared else "each",
+                    times[0],
+                    np.median(times[1:]),
+                    times.sum()))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
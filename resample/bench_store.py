@@ -0,0 +1,101 @@
+"""Compare map slice and point series latency of raw and ingested files
+
+Usage: python bench_store.py [PATH VARIABLE]
+
+Without arguments a temporary file chunked one map per chunk, as
+model post-processing typically writes them, is generated
+"""
+import sys
+import os
+import time
+import shutil
+import tempfile
+import netCDF4
+import numpy as np
+from store import ChunkedStore
+
+
+def sample_file(directory):
+    path = os.path.join(directory, "sample.nc")
+    shape = (24, 4, 800, 800)
+    with netCDF4.Dataset(path, "w") as dataset:
+        for name, size in zip(
+                ["time", "pressure", "latitude", "longitude"], shape):
+            dataset.createDimension(name, size)
+        var = dataset.createVariable(
+            "relative_humidity",
+            "f4",
+            ("time", "pressure", "latitude", "longitude"),
+            zlib=True,
+            chunksizes=(1, 1) + shape[2:])
+        random = np.random.RandomState(0)
+        for i in range(shape[0]):
+            var[i] = random.normal(size=shape[1:]).round(2)
+    return path, "relative_humidity"
+
+
+def timed(path, variable, read, indices):
+    times = []
+    with netCDF4.Dataset(path) as dataset:
+        var = dataset.variables[variable]
+        for index in indices:
+            start = time.perf_counter()
+            read(var, index)
+            times.append(time.perf_counter() - start)
+    return times
+
+
+def map_slice(var, index):
+    t, k, _, _ = index
+    if len(var.dimensions) == 4:
+        return var[t, k]
+    return var[t]
+
+
+def series(var, index):
+    _, k, j, i = index
+    if len(var.dimensions) == 4:
+        return var[:, k, j, i]
+    return var[:, j, i]
+
+
+def main(argv):
+    directory = tempfile.mkdtemp()
+    try:
+        if len(argv) == 2:
+            path, variable = argv
+        else:
+            path, variable = sample_file(directory)
+        with netCDF4.Dataset(path) as dataset:
+            var = dataset.variables[variable]
+            shape = var.shape
+            print("{} {} chunking: {}".format(
+                variable, shape, var.chunking()))
+        random = np.random.RandomState(1)
+        indices = list(zip(
+            random.randint(shape[0], size=20),
+            random.randint(shape[1] if len(shape) == 4 else 1, size=20),
+            random.randint(shape[-2], size=20),
+            random.randint(shape[-1], size=20)))
+        cases = [("raw netCDF", path)]
+        for zlib in [False, True]:
+            start = time.perf_counter()
+            copy = ChunkedStore(os.path.join(directory, str(zlib))).write(
+                path, variable, zlib=zlib)
+            print("ingest zlib={}: {:.2f} s, {:.1f} MB".format(
+                zlib,
+                time.perf_counter() - start,
+                os.path.getsize(copy) / 1e6))
+            cases.append(("store zlib={}".format(zlib), copy))
+        fmt = "{:>16} {:>7}: median {:8.2f} ms, max {:8.2f} ms"
+        for name, filename in cases:
+            for kind, read in [("slice", map_slice), ("series", series)]:
+                times = 1000 * np.array(
+                    timed(filename, variable, read, indices))
+                print(fmt.format(name, kind, np.median(times), times.max()))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
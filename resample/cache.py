@@ -0,0 +1,223 @@
+"""Memory-budgeted image cache shared across documents"""
+import os
+import json
+import hashlib
+import tempfile
+import threading
+import numpy as np
+from collections import OrderedDict
+
+
+class ImageCache(object):
+    """Least-recently-used cache with a byte budget
+
+    An entry costs the number of bytes held by its image arrays
+    and by any values derived from it. Once the total cost exceeds
+    ``max_bytes`` the least recently used entries are evicted until
+    the cache fits, pinned entries are never evicted. Safe to share
+    between threads
+
+    :param max_bytes: memory budget in bytes, None for no limit
+    """
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.pinned = set()
+        self._entries = OrderedDict()
+        self._costs = {}
+        self._derived = {}
+        self._lock = threading.RLock()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, key):
+        with self._lock:
+            value = self._entries[key]
+            self._entries.move_to_end(key)
+            return value
+
+    def __setitem__(self, key, value):
+        cost = self.cost(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = value
+            self._costs[key] = cost
+            self.nbytes += cost
+            self._evict()
+
+    def __delitem__(self, key):
+        with self._lock:
+            self._remove(key)
+            self.pinned.discard(key)
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries.keys())
+
+    def get(self, key, default=None):
+        """Look up an entry, counting a hit or a miss"""
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                return self[key]
+            self.misses += 1
+            return default
+
+    def derive(self, key, name, compute):
+        """Value computed from an entry, kept until the entry goes
+
+        Derived values are dropped when their entry is evicted or
+        replaced. Values derived from absent keys are not kept
+
+        :param name: hashable name of the derived value
+        :param compute: function returning an image dict
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            derived = self._derived.get(key, {})
+            if name in derived:
+                self._entries.move_to_end(key)
+                return derived[name]
+        value = compute()
+        cost = self.cost(value)
+        with self._lock:
+            if (entry is not None) and (self._entries.get(key) is entry):
+                self._derived.setdefault(key, {})[name] = value
+                self._costs[key] += cost
+                self.nbytes += cost
+                self._evict()
+        return value
+
+    def pin(self, key):
+        """Protect an entry from eviction"""
+        with self._lock:
+            self.pinned.add(key)
+
+    def unpin(self, key):
+        with self._lock:
+            self.pinned.discard(key)
+            self._evict()
+
+    def cost_of(self, key):
+        """Bytes charged for an entry, zero if absent"""
+        return self._costs.get(key, 0)
+
+    def fits(self, nbytes):
+        """True if nbytes more can be held by evicting unpinned entries"""
+        if self.max_bytes is None:
+            return True
+        with self._lock:
+            pinned = sum(self._costs.get(key, 0) for key in self.pinned)
+        return pinned + nbytes <= self.max_bytes
+
+    def resize(self, max_bytes):
+        """Change the budget, evicting entries if necessary"""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "nbytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+    @staticmethod
+    def cost(value):
+        """Bytes held by the image arrays of an entry"""
+        if not isinstance(value, dict):
+            return 0
+        return sum(getattr(image, "nbytes", 0)
+                   for image in value.get("image", []))
+
+    def _remove(self, key):
+        del self._entries[key]
+        self._derived.pop(key, None)
+        self.nbytes -= self._costs.pop(key)
+
+    def _evict(self):
+        if self.max_bytes is None:
+            return
+        for key in list(self._entries.keys()):
+            if self.nbytes <= self.max_bytes:
+                break
+            if key in self.pinned:
+                continue
+            self._remove(key)
+            self.evictions += 1
+
+
+class DiskCache(object):
+    """Stretched images persisted across restarts and processes
+
+    Each entry is a float32 ``.npy`` file that is opened as a
+    read-only memory map next to a ``.json`` file holding
+    x, y, dw and dh. Keys include the source file's mtime and
+    size so edited files are never served stale
+
+    Files are written to a temporary name and renamed into
+    place, so concurrent readers either see a complete entry
+    or nothing at all
+
+    :param directory: location of the cache files
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, path, variable, ipressure, itime):
+        stem = self.stem(path, variable, ipressure, itime)
+        try:
+            with open(stem + ".json") as stream:
+                image = json.load(stream)
+            values = np.load(stem + ".npy", mmap_mode="r")
+        except (IOError, ValueError):
+            return None
+        image["image"] = [values]
+        return image
+
+    def put(self, path, variable, ipressure, itime, image):
+        stem = self.stem(path, variable, ipressure, itime)
+        meta = {k: [float(image[k][0])] for k in ["x", "y", "dw", "dh"]}
+        values = np.asarray(image["image"][0], dtype=np.float32)
+        self.atomic_write(stem + ".json",
+                lambda stream: stream.write(json.dumps(meta).encode()))
+        self.atomic_write(stem + ".npy",
+                lambda stream: np.save(stream, values))
+
+    def stem(self, path, variable, ipressure, itime):
+        return stem(self.directory, path, variable, ipressure, itime)
+
+    def atomic_write(self, path, write):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as stream:
+                write(stream)
+            os.replace(tmp, path)
+        except Exception:
+            os.remove(tmp)
+            raise
+
+
+def stem(directory, path, *parts):
+    """Cache file name derived from a source file and key parts
+
+    The source file's mtime and size are part of the key so that
+    modified files never match stale entries
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size) + parts
+    digest = hashlib.sha1(repr(key).encode()).hexdigest()
+    return os.path.join(directory, digest)
@@ -1,154 +1,459 @@
 import os
+import bisect
 import datetime as dt
 import re
 import cartopy
 import glob
+import fnmatch
 import json
-import pandas as pd
 import numpy as np
 import netCDF4
+import hashlib
+import threading
 import scipy.interpolate
-import scipy.ndimage
 import geo
-from collections import OrderedDict
+import lightning
+import lines
+import summary
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from util import Observable, chain
+import cache
+from cache import ImageCache, DiskCache
+from pool import DatasetPool
+from prefetch import Prefetcher
+from sidecar import SeriesStore
+from store import ChunkedStore
 
 
 # Application data shared across documents
 FILE_DB = None
 LOADERS = {}
-IMAGES = OrderedDict()
-COASTLINES = {
-    "xs": [],
-    "ys": []
-}
-BORDERS = {
-    "xs": [],
-    "ys": []
-}
-
-def on_server_loaded(patterns):
+IMAGES = ImageCache()
+DISK = None
+DATASETS = DatasetPool()
+EXECUTOR = ThreadPoolExecutor(max_workers=4)
+IN_FLIGHT = {}
+IN_FLIGHT_LOCK = threading.Lock()
+PREFETCHER = None
+SERIES = None
+STORE = None
+ENCODING = "float32"
+VIEWPORT = False
+STRETCHES = {}
+COASTLINES = lines.Lines([])
+BORDERS = lines.Lines([])
+
+def on_server_loaded(patterns, cache_bytes=None, cache_dir=None,
+        prefetch_steps=0, series_dir=None, encoding="float32",
+        viewport=False, store_dir=None):
     global COASTLINES
     global BORDERS
     global FILE_DB
+    global DISK
+    global PREFETCHER
+    global SERIES
+    global STORE
+    global ENCODING
+    global VIEWPORT
+    ENCODING = encoding
+    VIEWPORT = viewport
+    IMAGES.resize(cache_bytes)
+    if cache_dir is not None:
+        DISK = DiskCache(cache_dir)
+    if series_dir is not None:
+        SERIES = SeriesStore(series_dir, DATASETS)
+    if store_dir is not None:
+        STORE = ChunkedStore(store_dir)
+    if prefetch_steps > 0:
+        PREFETCHER = Prefetcher(load_image, IMAGES, steps=prefetch_steps)
     FILE_DB = FileDB(patterns)
     FILE_DB.sync()
     for name, paths in FILE_DB.files.items():
-        if name == "RDT":
-            LOADERS[name] = RDT(paths)
-        elif "GPM" in name:
-            LOADERS[name] = GPM(paths)
-        elif name == "EarthNetworks":
-            LOADERS[name] = EarthNetworks(paths)
-        else:
-            LOADERS[name] = UMLoader(paths, name=name)
+        LOADERS[name] = make_loader(name, paths)
+    FILE_DB.subscribe(on_files)
 
     # Example of server-side pre-caching
     for name in [
             "Tropical Africa 4.4km"]:
         path = FILE_DB.files[name][0]
-        load_image(path, "relative_humidity", 0, 0)
+        load_image(path, "relative_humidity", 0, 0, pin=True)
 
     # Load coastlines/borders
     COASTLINES = feature_lines(cartopy.feature.COASTLINE)
     BORDERS = feature_lines(cartopy.feature.BORDERS)
 
 
+def make_loader(name, paths):
+    cls = loader_class(name)
+    if cls is UMLoader:
+        return UMLoader(paths, name=name)
+    return cls(paths)
+
+
+def loader_class(name):
+    if name == "RDT":
+        return RDT
+    elif "GPM" in name:
+        return GPM
+    elif name == "EarthNetworks":
+        return EarthNetworks
+    else:
+        return UMLoader
+
+
+def poll():
+    """Synchronise FILE_DB off the IO loop"""
+    if FILE_DB is not None:
+        EXECUTOR.submit(FILE_DB.sync)
+
+
+def on_files(name, added, removed):
+    print("files changed: {} +{} -{}".format(name, len(added), len(removed)))
+    if name in LOADERS:
+        LOADERS[name].on_files(added, removed)
+    elif len(FILE_DB.files[name]) > 0:
+        LOADERS[name] = make_loader(name, FILE_DB.files[name])
+
+
 def feature_lines(feature):
-    xs, ys = [], []
+    """Level of detail store of a feature's lines in web mercator"""
+    coords = []
     for geometry in feature.geometries():
-        for g in geometry:
-            lons, lats = g.xy
-            x, y = geo.web_mercator(lons, lats)
-            xs.append(x)
-            ys.append(y)
-    return {
-        "xs": xs,
-        "ys": ys
-    }
+        for g in getattr(geometry, "geoms", [geometry]):
+            if len(g.coords) > 1:
+                coords.append(np.asarray(g.coords)[:, :2])
+    if len(coords) == 0:
+        return lines.Lines([])
+    lons, lats = np.concatenate(coords).T
+    x, y = geo.web_mercator(lons, lats)
+    splits = np.cumsum([len(c) for c in coords])[:-1]
+    return lines.Lines(list(zip(np.split(x, splits), np.split(y, splits))))
+
+
+Entry = namedtuple("Entry", ["size", "mtime", "initial_time"])
+
+
+class FileDB(Observable):
+    """Incremental catalogue of files matching glob patterns
 
+    A pattern's directory is only listed again when its mtime
+    changes. Known entries are stat'ed on every sync, files whose
+    size or mtime changed, e.g. while still being written, are
+    announced as both removed and added. Listeners receive
+    (name, added, removed) whenever a pattern's files change
 
-class FileDB(object):
+    .. note:: Patterns with wildcards in the directory part
+              fall back to a full glob on every sync
+    """
     def __init__(self, patterns):
         self.patterns = patterns
         self.names = list(patterns.keys())
         self.files = {}
+        self.entries = {name: {} for name in self.names}
+        self.mtimes = {}
+        self._lock = threading.Lock()
+        super().__init__()
 
     def sync(self):
-        for key, pattern in self.patterns.items():
-            self.files[key] = glob.glob(pattern)
+        if not self._lock.acquire(blocking=False):
+            return  # Previous sync still running
+        try:
+            for name, pattern in self.patterns.items():
+                added, removed = self.sync_pattern(name, pattern)
+                if len(added) > 0 or len(removed) > 0:
+                    self.announce(name, added, removed)
+        finally:
+            self._lock.release()
+
+    def sync_pattern(self, name, pattern):
+        entries = self.entries[name]
+        paths = self.list_pattern(name, pattern)
+        if paths is None:
+            paths = list(entries)  # Directory unchanged
+        added = sorted(set(paths) - set(entries))
+        removed = sorted(set(entries) - set(paths))
+        for path in removed:
+            del entries[path]
+        changed = []
+        for path in sorted(set(paths)):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                if path in entries:
+                    del entries[path]
+                    removed.append(path)
+                else:
+                    added.remove(path)  # Removed since listing
+                continue
+            entry = entries.get(path)
+            if entry is not None:
+                if (entry.size, entry.mtime) == (stat.st_size, stat.st_mtime):
+                    continue
+                changed.append(path)
+            entries[path] = Entry(
+                stat.st_size,
+                stat.st_mtime,
+                initial_time(path))
+        self.files[name] = sorted(entries)
+        return sorted(added + changed), sorted(removed + changed)
+
+    def list_pattern(self, name, pattern):
+        """Paths matching a pattern, None if its directory is unchanged"""
+        directory, basename = os.path.split(pattern)
+        if glob.has_magic(directory):
+            return glob.glob(pattern)
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            mtime = None
+        if (name in self.files) and (self.mtimes.get(name) == mtime):
+            return None
+        self.mtimes[name] = mtime
+        if mtime is None:
+            return []
+        return [os.path.join(directory, entry.name)
+                for entry in os.scandir(directory)
+                if fnmatch.fnmatch(entry.name, basename)]
+
+
+def updated(paths, added, removed):
+    return sorted((set(paths) - set(removed)) | set(added))
 
 
 class EarthNetworks(object):
     def __init__(self, paths):
         self.paths = paths
-        self.frame = self.read(paths)
-        print(self.frame)
+        self.flashes = self.read(paths)
+        self.levels = {}
+        print("EarthNetworks: {} flashes".format(len(self.flashes)))
+
+    def on_files(self, added, removed):
+        paths = updated(self.paths, added, removed)
+        self.flashes = self.read(paths)
+        self.levels = {}
+        self.paths = paths
 
     @staticmethod
     def read(csv_files):
         if isinstance(csv_files, str):
             csv_files = [csv_files]
-        frames = []
-        for csv_file in csv_files:
-            frame = pd.read_csv(
-                csv_file,
-                parse_dates=[1],
-                converters={0: EarthNetworks.flash_type},
-                usecols=[0, 1, 2, 3],
-                names=["flash_type", "date", "latitude", "longitude"],
-                header=None)
-            frames.append(frame)
-        if len(frames) == 0:
-            return None
+        if DISK is None:
+            directory = None
         else:
-            return pd.concat(frames, ignore_index=True)
+            directory = os.path.join(DISK.directory, "lightning")
+        return lightning.Flashes.concat(
+            [lightning.load(csv_file, directory)
+             for csv_file in csv_files])
 
+    def query(self, start=None, end=None, bbox=None):
+        """Flashes in a time window and lon/lat bounding box"""
+        return self.flashes.query(start=start, end=end, bbox=bbox)
 
-    @staticmethod
-    def flash_type(value):
-        return {
-            "0": "CG",
-            "1": "IC",
-            "9": "Keep alive"
-        }.get(value, value)
+    def count(self, start=None, end=None, bbox=None):
+        """Number of flashes query would return"""
+        return self.flashes.count(start=start, end=end, bbox=bbox)
+
+    def aggregate(self, level):
+        """Flash counts in web mercator cells of a zoom level
+
+        Level z cells are 1/2**z of the web mercator world wide,
+        counts are computed once per level and shared by documents
+        """
+        if level not in self.levels:
+            flashes = self.flashes
+            x, y = geo.web_mercator(
+                flashes.columns["longitude"],
+                flashes.columns["latitude"])
+            size = geo.WORLD_WIDTH / 2**level
+            self.levels[level] = lightning.aggregate(x, y, size)
+        return self.levels[level]
 
 
 class RDT(object):
+    """Rapidly developing thunderstorm GeoJSON files
+
+    Files are ordered by the validity time in their names and
+    projected on first use, projected results are cached per path
+    """
     def __init__(self, paths):
-        self.paths = paths
-        self.geojson = self.load(self.paths[0])
+        self.index = self.sort(paths)
+        self.geojsons = {}
+
+    @property
+    def paths(self):
+        return self.index[0]
+
+    def on_files(self, added, removed):
+        self.index = self.sort(updated(self.paths, added, removed))
+        for path in removed:
+            self.geojsons.pop(path, None)
+
+    @staticmethod
+    def sort(paths):
+        """Paths and their validity times ordered by time
+
+        Times are parsed once here so that find only bisects
+        """
+        pairs = sorted((rdt_time(p) or dt.datetime.min, p) for p in paths)
+        return [p for _, p in pairs], [t for t, _ in pairs]
+
+    def geojson(self, valid=None):
+        """GeoJSON of the latest file valid at or before a time
+
+        :param valid: datetime, defaults to the earliest file
+        """
+        path = self.find(valid)
+        mtime = os.stat(path).st_mtime_ns
+        cached = self.geojsons.get(path)
+        if (cached is None) or (cached[0] != mtime):
+            cached = (mtime, self.load(path))
+            self.geojsons[path] = cached
+        return cached[1]
+
+    def find(self, valid):
+        paths, times = self.index
+        if valid is None:
+            return paths[0]
+        valid = dt.datetime(
+            valid.year, valid.month, valid.day, valid.hour, valid.minute)
+        i = bisect.bisect_right(times, valid) - 1
+        return paths[max(i, 0)]
 
     @staticmethod
     def load(path):
         with open(path) as stream:
             rdt = json.load(stream)
 
-        copy = dict(rdt)
-        for i, feature in enumerate(rdt["features"]):
-            coordinates = feature['geometry']['coordinates'][0]
-            lons, lats = np.asarray(coordinates).T
+        # Project every outer ring in a single call
+        rings = [np.asarray(feature['geometry']['coordinates'][0],
+                            dtype="d").reshape(-1, 2)
+                 for feature in rdt["features"]]
+        if len(rings) > 0:
+            lengths = [len(ring) for ring in rings]
+            lons, lats = np.concatenate(rings).T
             x, y = geo.web_mercator(lons, lats)
-            c = np.array([x, y]).T.tolist()
-            copy["features"][i]['geometry']['coordinates'][0] = c
+            xy = np.column_stack([x, y])
+            for feature, c in zip(rdt["features"],
+                                  np.split(xy, np.cumsum(lengths)[:-1])):
+                feature['geometry']['coordinates'][0] = c.tolist()
 
         # Hack to use Categorical mapper
-        for i, feature in enumerate(rdt["features"]):
+        for feature in rdt["features"]:
             p = feature['properties']['PhaseLife']
-            copy["features"][i]['properties']['PhaseLife'] = str(p)
+            feature['properties']['PhaseLife'] = str(p)
 
-        return json.dumps(copy)
+        return json.dumps(rdt)
+
+
+def rdt_time(path):
+    groups = re.search(r"[0-9]{12}", os.path.basename(path))
+    if groups:
+        return dt.datetime.strptime(groups[0], "%Y%m%d%H%M")
 
 
 class GPM(object):
-    def __init__(self, paths):
-        self.paths = paths
+    """GPM IMERG precipitation across many files
+
+    Each file's time axis is read once, cached in memory and in
+    the disk cache directory, and concatenated into one index so
+    that image(itime) finds its file by binary search
+
+    :param period: time covered by each record
+    """
+    def __init__(self, paths, period=dt.timedelta(minutes=30)):
+        self.period = period
+        self.index = ([], [], [0])
+        self.axes = {}
+        self.on_files(paths, [])
+
+    @property
+    def paths(self):
+        return self.index[0]
+
+    @property
+    def times(self):
+        return self.index[1]
+
+    def on_files(self, added, removed):
+        """Swap in a rebuilt index with a single assignment
+
+        locate runs on other threads, it must never pair paths of
+        one index with offsets of another
+        """
+        paths = updated(self.paths, added, removed)
+        for path in removed:
+            self.axes.pop(path, None)
+        times, offsets = [], [0]
+        for path in paths:
+            axis = self.time_axis(path)
+            times += list(axis)
+            offsets.append(offsets[-1] + len(axis))
+        self.index = (paths, times, offsets)
+
+    def time_axis(self, path):
+        mtime = os.stat(path).st_mtime_ns
+        cached = self.axes.get(path)
+        if (cached is None) or (cached[0] != mtime):
+            cached = (mtime, read_times(path))
+            self.axes[path] = cached
+        return cached[1]
+
+    def locate(self, itime):
+        """File and record holding a global time index"""
+        paths, times, offsets = self.index
+        if not (0 <= itime < len(times)):
+            raise IndexError("itime {} out of range".format(itime))
+        i = bisect.bisect_right(offsets, itime) - 1
+        return paths[i], itime - offsets[i]
+
+    def find(self, valid):
+        """Global index of the record covering a time
+
+        :param valid: datetime
+        :returns: index or None if no record covers valid
+        """
+        if valid is None:
+            return None
+        times = self.times
+        i = bisect.bisect_right(times, valid) - 1
+        if (i < 0) or (valid - times[i] >= self.period):
+            return None
+        return i
 
     def image(self, itime):
-        return load_image(
-                self.paths[0],
-                "precipitation_flux",
-                0,
-                itime)
+        return load_image(*self.key(itime))
+
+    def image_async(self, itime):
+        """Future of the same data returned by image"""
+        return load_image_async(*self.key(itime))
+
+    def key(self, itime):
+        """Image cache key of a global time index"""
+        path, local = self.locate(itime)
+        return (path, "precipitation_flux", 0, local)
+
+
+def read_times(path):
+    """Time axis of a file, cached alongside the disk image cache"""
+    filename = None
+    if DISK is not None:
+        filename = cache.stem(DISK.directory, path, "times") + ".json"
+        try:
+            with open(filename) as stream:
+                content = json.load(stream)
+            return netCDF4.num2date(content["values"], units=content["units"])
+        except (IOError, ValueError):
+            pass
+    with DATASETS.dataset(path) as dataset:
+        var = dataset.variables["time"]
+        values = var[:].tolist()
+        units = var.units
+    if filename is not None:
+        content = json.dumps({"values": values, "units": units})
+        DISK.atomic_write(filename,
+                lambda stream: stream.write(content.encode()))
+    return netCDF4.num2date(values, units=units)
 
 
 def initial_time(path):
@@ -161,9 +466,43 @@ def initial_time(path):
 class UMLoader(object):
     def __init__(self, paths, name="UM"):
         self.name = name
+        self.paths = []
+        self.initial_times = {}
+        self.on_files(paths, [])
+
+    def on_files(self, added, removed):
+        """Track files, re-reading metadata if the first file changes
+
+        Images and series are read from the first file, so its axes
+        must describe it after a purge or an in-place rewrite
+        """
+        initial_times = dict(self.initial_times)
+        for path in removed:
+            initial_times.pop(initial_time(path), None)
+        for path in added:
+            initial_times[initial_time(path)] = path
+        self.initial_times = initial_times
+        paths = updated(self.paths, added, removed)
+        first = paths[0] if len(paths) > 0 else None
+        if ((len(self.paths) == 0) or (first != self.paths[0]) or
+                (first in removed)):
+            self.load_metadata(first)
         self.paths = paths
-        self.initial_times = {initial_time(p): p for p in paths}
-        with netCDF4.Dataset(self.paths[0]) as dataset:
+
+    def load_metadata(self, path):
+        """Read dimensions, times, variables and levels of a file
+
+        :param path: file to describe, None if there are no files
+        """
+        self._axes = {}
+        if path is None:
+            self.dimensions = {}
+            self.dimension_variables = {}
+            self.times = {}
+            self.variables = []
+            self.pressure_variables, self.pressures = set(), []
+            return
+        with DATASETS.dataset(path) as dataset:
             self.dimensions = self.load_dimensions(dataset)
             self.dimension_variables = self.load_dimension_variables(dataset)
             self.times = self.load_times(dataset)
@@ -219,6 +558,55 @@ class UMLoader(object):
                 if d in dataset.variables}
 
     def image(self, variable, ipressure, itime):
+        variable, metadata = self.metadata(variable, ipressure, itime)
+        indices = self.column(variable, ipressure, itime)
+        images = load_images(self.paths[0], variable, indices)
+        data = dict(images[indices.index((itime, ipressure))])
+        data.update(metadata)
+        self.prefetch(variable, ipressure, itime)
+        return data
+
+    def image_async(self, variable, ipressure, itime):
+        """Future of the same data returned by image"""
+        variable, metadata = self.metadata(variable, ipressure, itime)
+        indices = self.column(variable, ipressure, itime)
+        futures = load_images_async(self.paths[0], variable, indices)
+        future = futures[indices.index((itime, ipressure))]
+        future.add_done_callback(
+                lambda f: self.prefetch(variable, ipressure, itime))
+        return chain(future, lambda data: dict(data, **metadata))
+
+    def column(self, variable, ipressure, itime):
+        """Indices read together with a field
+
+        Every level of a pressure variable is read in one hyperslab
+        and cached, so changing level is a memory hit
+
+        :returns: list of (itime, ipressure) tuples
+        """
+        if variable in self.pressure_variables:
+            return [(itime, j) for j in range(len(self.pressures))]
+        return [(itime, ipressure)]
+
+    def key(self, variable, ipressure, itime):
+        """Image cache key of a field"""
+        variable, _ = self.metadata(variable, ipressure, itime)
+        return (self.paths[0], variable, ipressure, itime)
+
+    def prefetch(self, variable, ipressure, itime):
+        """Warm neighbouring time steps, levels come with each column"""
+        if PREFETCHER is None:
+            return
+        nbytes = IMAGES.cost_of((self.paths[0], variable, ipressure, itime))
+        ntimes = len(self.times[self.dimensions[variable][0]])
+        indices = []
+        for step in range(1, PREFETCHER.steps + 1):
+            for i in [itime + step, itime - step]:
+                if 0 <= i < ntimes:
+                    indices.append((i, ipressure))
+        PREFETCHER.prefetch(self.paths[0], variable, indices, nbytes)
+
+    def metadata(self, variable, ipressure, itime):
         try:
             dimension = self.dimensions[variable][0]
         except KeyError as e:
@@ -232,30 +620,130 @@ class UMLoader(object):
         initial = times[0]
         hours = (valid - initial).total_seconds() / (60*60)
         length = "T{:+}".format(int(hours))
-        data = load_image(
-                self.paths[0],
-                variable,
-                ipressure,
-                itime)
         if variable in self.pressure_variables:
             level = "{} hPa".format(int(self.pressures[ipressure]))
         else:
             level = "Surface"
-        data["name"] = [self.name]
-        data["valid"] = [valid]
-        data["initial"] = [initial]
-        data["length"] = [length]
-        data["level"] = [level]
-        return data
+        return variable, {
+            "name": [self.name],
+            "valid": [valid],
+            "initial": [initial],
+            "length": [length],
+            "level": [level]
+        }
 
     def series(self, variable, x0, y0, k):
-        lon0, lat0 = geo.plate_carree(x0, y0)
-        lon0, lat0 = lon0[0], lat0[0]  # Map to scalar
-        lons = geo.to_180(self.longitudes(variable))
-        lats = self.latitudes(variable)
-        i = np.argmin(np.abs(lons - lon0))
-        j = np.argmin(np.abs(lats - lat0))
-        return self.series_ijk(variable, i, j, k)
+        """Series at the grid point nearest a web mercator point"""
+        result = self.series_points(variable, [x0], [y0], k)
+        return {"x": result["x"], "y": result["y"][0]}
+
+    def series_async(self, variable, x0, y0, k):
+        """Future of series run on the shared executor"""
+        return EXECUTOR.submit(self.series, variable, x0, y0, k)
+
+    def series_points(self, variable, xs, ys, k):
+        """Series at many web mercator points in one read
+
+        :returns: dict with times and a (points, time) array
+        """
+        i, j = self.nearest(variable, xs, ys)
+        return {
+            "x": self.series_times(variable),
+            "y": self.read_columns(variable, i, j, k)}
+
+    def series_boxes(self, variable, boxes, k):
+        """Mean series over web mercator boxes (x0, y0, x1, y1)
+
+        Summed-area tables make each box O(1) per time step,
+        missing values are excluded from the means
+
+        :returns: dict with times and a (boxes, time) array
+        """
+        boxes = np.asarray(boxes, dtype="d").reshape(-1, 4)
+        lons, lats = geo.plate_carree(
+            np.concatenate([boxes[:, 0], boxes[:, 2]]),
+            np.concatenate([boxes[:, 1], boxes[:, 3]]))
+        lon_axis, lon_order = self.sorted_axis("longitude", variable)
+        lat_axis, lat_order = self.sorted_axis("latitude", variable)
+        n = len(boxes)
+        i0 = np.searchsorted(lon_axis, np.minimum(lons[:n], lons[n:]), "left")
+        i1 = np.searchsorted(lon_axis, np.maximum(lons[:n], lons[n:]), "right")
+        j0 = np.searchsorted(lat_axis, np.minimum(lats[:n], lats[n:]), "left")
+        j1 = np.searchsorted(lat_axis, np.maximum(lats[:n], lats[n:]), "right")
+
+        # Read the window covering every box, ordered by coordinate
+        columns = lon_order[i0.min():i1.max()]
+        rows = lat_order[j0.min():j1.max()]
+        window = self.read_window(variable, rows, columns, k)
+        i0, i1 = i0 - i0.min(), i1 - i0.min()
+        j0, j1 = j0 - j0.min(), j1 - j0.min()
+
+        valid = np.isfinite(window)
+        sums = summed_area(np.where(valid, window, 0))
+        counts = summed_area(valid.astype("d"))
+
+        def box(table):
+            return (table[:, j1, i1] - table[:, j0, i1] -
+                    table[:, j1, i0] + table[:, j0, i0])
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = box(sums) / box(counts)
+        return {
+            "x": self.series_times(variable),
+            "y": means.T}
+
+    def nearest(self, variable, xs, ys):
+        """Indices of grid points nearest web mercator points"""
+        lons, lats = geo.plate_carree(xs, ys)
+        i = nearest_index(*self.sorted_axis("longitude", variable), lons)
+        j = nearest_index(*self.sorted_axis("latitude", variable), lats)
+        return i, j
+
+    def sorted_axis(self, prefix, variable):
+        """Sorted coordinates and their original indices, cached"""
+        key = (prefix, self._dimension(prefix, variable))
+        if key not in self._axes:
+            values = self._lookup(prefix, variable)
+            if prefix == "longitude":
+                values = geo.to_180(values)
+            order = np.argsort(values, kind="stable")
+            self._axes[key] = (np.asarray(values)[order], order)
+        return self._axes[key]
+
+    def series_times(self, variable):
+        return self.times[self.dimensions[variable][0]]
+
+    def read_columns(self, variable, i, j, k):
+        """(points, time) values at index pairs in a single read
+
+        Values come from the time-major sidecar if it is built, the
+        first read of a variable schedules a background build
+        """
+        if SERIES is not None:
+            store = SERIES.get(self.paths[0], variable)
+            if store is None:
+                SERIES.build_async(self.paths[0], variable)
+            elif store.ndim == 4:
+                return np.array(store[k, j, i])
+            else:
+                return np.array(store[j, i])
+        rows, jpos = np.unique(j, return_inverse=True)
+        columns, ipos = np.unique(i, return_inverse=True)
+        window = self.read_window(variable, rows, columns, k)
+        return window[:, jpos, ipos].T
+
+    def read_window(self, variable, rows, columns, k):
+        """(time, rows, columns) block as floats with NaN for missing"""
+        rows, columns = list(rows), list(columns)
+        with DATASETS.dataset(source(self.paths[0], variable)) as dataset:
+            var = dataset.variables[variable]
+            if len(var.dimensions) == 4:
+                values = var[:, k, rows, columns]
+            elif len(var.dimensions) == 3:
+                values = var[:, rows, columns]
+            else:
+                raise NotImplementedError("3 or 4 dimensions only")
+        return np.ma.filled(np.ma.asarray(values, dtype="d"), np.nan)
 
     def longitudes(self, variable):
         return self._lookup("longitude", variable)
@@ -264,76 +752,222 @@ class UMLoader(object):
         return self._lookup("latitude", variable)
 
     def _lookup(self, prefix, variable):
+        return self.dimension_variables[self._dimension(prefix, variable)]
+
+    def _dimension(self, prefix, variable):
         dims = self.dimensions[variable]
         for dim in dims:
             if dim.startswith(prefix):
-                return self.dimension_variables[dim]
+                return dim
 
-    def series_ijk(self, variable, i, j, k):
-        path = self.paths[0]
-        dimension = self.dimensions[variable][0]
-        times = self.times[dimension]
-        with netCDF4.Dataset(path) as dataset:
-            var = dataset.variables[variable]
-            if len(var.dimensions) == 4:
-                values = var[:, k, j, i]
-            elif len(var.dimensions) == 3:
-                values = var[:, j, i]
+
+def nearest_index(sorted_values, order, values):
+    """Original indices of nearest sorted values via searchsorted"""
+    values = np.asarray(values)
+    right = np.clip(
+        np.searchsorted(sorted_values, values), 1, len(sorted_values) - 1)
+    left = right - 1
+    closer = (np.abs(values - sorted_values[left]) <=
+              np.abs(sorted_values[right] - values))
+    return order[np.where(closer, left, right)]
+
+
+def summed_area(values):
+    """Zero-padded cumulative sums over the last two axes"""
+    table = np.zeros(values.shape[:-2] + (
+        values.shape[-2] + 1, values.shape[-1] + 1))
+    table[..., 1:, 1:] = values.cumsum(axis=-2).cumsum(axis=-1)
+    return table
+
+
+def load_image(path, variable, ipressure, itime, pin=False):
+    if pin:
+        IMAGES.pin((path, variable, ipressure, itime))
+    return load_images(path, variable, [(itime, ipressure)])[0]
+
+
+def load_image_async(path, variable, ipressure, itime):
+    """Load an image on the shared executor
+
+    Concurrent requests for the same key share a single future,
+    so a field is only decoded once however many documents ask
+
+    :returns: concurrent.futures.Future of the image
+    """
+    return load_images_async(path, variable, [(itime, ipressure)])[0]
+
+
+def load_images_async(path, variable, indices):
+    """Futures of several images, keys nobody is loading are read
+    together in one job on the shared executor
+
+    :param indices: list of (itime, ipressure) tuples
+    :returns: list of futures in the same order as indices
+    """
+    keys = [(path, variable, ipressure, itime)
+            for itime, ipressure in indices]
+    futures, claimed = claim(keys)
+    if len(claimed) > 0:
+        EXECUTOR.submit(resolve, path, variable, claimed)
+    return [futures[key] for key in keys]
+
+
+def load_images(path, variable, indices, executor=None):
+    """Load several (itime, ipressure) images from a single read
+
+    Images missing from the memory and disk caches are read in
+    one hyperslab and stretched as a stack. Images already being
+    loaded by another thread are waited on rather than re-read
+
+    :param indices: list of (itime, ipressure) tuples
+    :param executor: optional thread pool to stretch slices in
+    :returns: list of images in the same order as indices
+    """
+    keys = [(path, variable, ipressure, itime)
+            for itime, ipressure in indices]
+    futures, claimed = claim(keys)
+    if len(claimed) > 0:
+        resolve(path, variable, claimed, executor=executor)
+    return [futures[key].result() for key in keys]
+
+
+def claim(keys):
+    """Share in-flight futures and claim keys nobody is loading
+
+    :returns: dict of futures by key and list of claimed keys
+    """
+    futures = {}
+    claimed = []
+    with IN_FLIGHT_LOCK:
+        for key in keys:
+            if key in futures:
+                continue
+            if key in IN_FLIGHT:
+                futures[key] = IN_FLIGHT[key]
+                continue
+            future = Future()
+            image = IMAGES.get(key)
+            if image is None:
+                IN_FLIGHT[key] = future
+                claimed.append(key)
             else:
-                raise NotImplementedError("3 or 4 dimensions only")
-        return {
-            "x": times,
-            "y": values}
+                print("already seen: {}".format(key))
+                future.set_result(image)
+            futures[key] = future
+    return futures, claimed
 
 
-def load_image(path, variable, ipressure, itime):
-    key = (path, variable, ipressure, itime)
-    if key in IMAGES:
-        print("already seen: {}".format(key))
-        return IMAGES[key]
-    else:
-        print("loading: {}".format(key))
-        with netCDF4.Dataset(path) as dataset:
-            try:
-                var = dataset.variables[variable]
-            except KeyError as e:
-                if variable == "precipitation_flux":
-                    var = dataset.variables["stratiform_rainfall_rate"]
-                else:
-                    raise e
-            for d in var.dimensions:
-                if "longitude" in d:
-                    lons = dataset.variables[d][:]
-                if "latitude" in d:
-                    lats = dataset.variables[d][:]
-            if len(var.dimensions) == 4:
-                values = var[itime, ipressure, :]
+def resolve(path, variable, keys, executor=None):
+    """Load claimed keys and complete their futures"""
+    try:
+        images = {}
+        missing = []
+        for key in keys:
+            image = disk_image(key)
+            if image is None:
+                missing.append(key)
             else:
-                values = var[itime, :]
-        image = stretch_image(lons, lats, values)
-        IMAGES[key] = image
-        return image
+                images[key] = image
+        if len(missing) > 0:
+            images.update(read_images(path, variable, missing, executor))
+        for key in keys:
+            IMAGES[key] = images[key]
+            summary.cached(IMAGES, key, images[key]["image"])
+        with IN_FLIGHT_LOCK:
+            for key in keys:
+                IN_FLIGHT.pop(key).set_result(images[key])
+    except Exception as e:
+        with IN_FLIGHT_LOCK:
+            for key in keys:
+                if key in IN_FLIGHT:
+                    IN_FLIGHT.pop(key).set_exception(e)
+
+
+def read_images(path, variable, keys, executor=None):
+    """Read and stretch images in a single hyperslab"""
+    print("loading: {} {} {}".format(path, variable, keys))
+    itimes = sorted(set(key[3] for key in keys))
+    ipressures = sorted(set(key[2] for key in keys))
+    with DATASETS.dataset(source(path, variable)) as dataset:
+        var, lons, lats = read_variable(dataset, variable)
+        if len(var.dimensions) == 4:
+            block = var[itimes, ipressures, :]
+            stack = [block[itimes.index(i), ipressures.index(j)]
+                     for _, _, j, i in keys]
+        else:
+            block = var[itimes, :]
+            stack = [block[itimes.index(i)] for _, _, _, i in keys]
+    # Masked points become NaN, images are stored as float32
+    stack = np.ma.filled(np.ma.stack(stack).astype(np.float32), np.nan)
+    stretched = stretch_images(lons, lats, stack, executor=executor)
+    images = {}
+    for key, image in zip(keys, stretched):
+        if DISK is not None:
+            DISK.put(*key, image)
+        images[key] = image
+    return images
+
+
+def source(path, variable):
+    """Ingested copy of a variable if there is one, else the file"""
+    if STORE is None:
+        return path
+    stored = STORE.get(path, variable)
+    if stored is None:
+        return path
+    return stored
+
+
+def disk_image(key):
+    """Find an image in the disk cache"""
+    if DISK is None:
+        return None
+    image = DISK.get(*key)
+    if image is not None:
+        print("from disk: {}".format(key))
+    return image
+
+
+def read_variable(dataset, variable):
+    try:
+        var = dataset.variables[variable]
+    except KeyError as e:
+        if variable == "precipitation_flux":
+            var = dataset.variables["stratiform_rainfall_rate"]
+        else:
+            raise e
+    for d in var.dimensions:
+        if "longitude" in d:
+            lons = dataset.variables[d][:]
+        if "latitude" in d:
+            lats = dataset.variables[d][:]
+    return var, lons, lats
 
 
 def stretch_image(lons, lats, values):
+    return stretch_images(lons, lats, values[np.newaxis])[0]
+
+
+def stretch_images(lons, lats, stack, executor=None):
+    """Stretch an (n, ny, nx) stack of images in one pass"""
     gx, _ = geo.web_mercator(
         lons,
         np.zeros(len(lons), dtype="d"))
     _, gy = geo.web_mercator(
         np.zeros(len(lats), dtype="d"),
         lats)
-    image = stretch_y(gy)(values)
+    stretched = stretch_y(gy)(stack, executor=executor)
     x = gx.min()
     y = gy.min()
     dw = gx[-1] - gx[0]
     dh = gy[-1] - gy[0]
-    return {
+    return [{
         "x": [x],
         "y": [y],
         "dw": [dw],
         "dh": [dh],
         "image": [image]
-    }
+    } for image in stretched]
 
 
 def stretch_y(uneven_y):
@@ -342,34 +976,76 @@ def stretch_y(uneven_y):
     To remedy this effect an even-spaced resampling is performed
     in the projected space to make the pixels and grid line up
 
+    Stretches are cached by a hash of the axis, since every field
+    and time step on a grid shares the same latitudes
+
     .. note:: This approach assumes the grid is evenly spaced
               in longitude/latitude space prior to projection
     """
-    if isinstance(uneven_y, list):
-        uneven_y = np.asarray(uneven_y, dtype=np.float)
-    even_y = np.linspace(
-        uneven_y.min(), uneven_y.max(), len(uneven_y),
-        dtype=np.float)
-    index = np.arange(len(uneven_y), dtype=np.float)
-    index_function = scipy.interpolate.interp1d(uneven_y, index)
-    index_fractions = index_function(even_y)
-
-    def wrapped(values, axis=0):
+    uneven_y = np.asarray(uneven_y, dtype=np.float64)
+    key = hashlib.sha1(uneven_y.tobytes()).hexdigest()
+    if key not in STRETCHES:
+        STRETCHES[key] = Stretch(uneven_y)
+    return STRETCHES[key]
+
+
+class Stretch(object):
+    """Separable linear interpolation onto an even-spaced axis
+
+    Each output row is a weighted sum of two neighbouring input
+    rows, the row indices and weights are computed once per axis
+    """
+    def __init__(self, uneven_y):
+        self.size = len(uneven_y)
+        even_y = np.linspace(
+            uneven_y.min(), uneven_y.max(), len(uneven_y),
+            dtype=np.float64)
+        index = np.arange(len(uneven_y), dtype=np.float64)
+        index_function = scipy.interpolate.interp1d(uneven_y, index)
+        index_fractions = index_function(even_y)
+        self.lower = np.clip(
+            np.floor(index_fractions).astype(int),
+            0, max(self.size - 2, 0))
+        self.upper = np.minimum(self.lower + 1, self.size - 1)
+        self.weights = index_fractions - self.lower
+
+    def __call__(self, values, axis=0, executor=None):
+        """Stretch a 2D array or an (n, ny, nx) stack of arrays
+
+        :param axis: axis of each 2D slice to stretch
+        :param executor: optional thread pool to split a stack across
+        """
         if isinstance(values, list):
-            values = np.asarray(values, dtype=np.float)
-        assert values.ndim == 2, "Can only stretch 2D arrays"
-        msg = "{} != {} do not match".format(values.shape[axis], len(uneven_y))
-        assert values.shape[axis] == len(uneven_y), msg
-        if axis == 0:
-            i = index_fractions
-            j = np.arange(values.shape[1], dtype=np.float)
-        elif axis == 1:
-            i = np.arange(values.shape[0], dtype=np.float)
-            j = index_fractions
-        else:
+            values = np.asarray(values, dtype=np.float64)
+        values = np.asarray(values)
+        assert values.ndim in (2, 3), "Can only stretch 2D arrays or stacks"
+        if axis not in (0, 1):
             raise Exception("Can only handle axis 0 or 1")
-        return scipy.ndimage.map_coordinates(
-            values,
-            np.meshgrid(i, j, indexing="ij"),
-            order=1)
-    return wrapped
+        if values.ndim == 3:
+            axis += 1
+        msg = "{} != {} do not match".format(values.shape[axis], self.size)
+        assert values.shape[axis] == self.size, msg
+        if np.issubdtype(values.dtype, np.floating):
+            dtype = values.dtype
+        else:
+            dtype = np.float64
+        result = np.empty(values.shape, dtype=dtype)
+        if (executor is None) or (values.ndim == 2):
+            self._stretch(values, axis, result)
+        else:
+            futures = [
+                executor.submit(self._stretch, values[i], axis - 1, result[i])
+                for i in range(len(values))]
+            for future in futures:
+                future.result()
+        return result
+
+    def _stretch(self, values, axis, out):
+        shape = [1] * values.ndim
+        shape[axis] = -1
+        weights = self.weights.astype(out.dtype).reshape(shape)
+        lower = np.take(values, self.lower, axis=axis)
+        upper = np.take(values, self.upper, axis=axis)
+        np.subtract(upper, lower, out=out)
+        out *= weights
+        out += lower
@@ -0,0 +1,114 @@
+"""Compact encodings of images sent to the browser"""
+import numpy as np
+
+
+DTYPES = {
+    "uint8": np.uint8,
+    "uint16": np.uint16
+}
+LUTS = {}
+
+
+def encode(data, mode="float32", low=None, high=None, lut=None):
+    """Copy of image data with its images encoded for transfer
+
+    Images are returned C-contiguous, so Bokeh can send them as
+    binary buffers without copying them first. In float32 mode
+    images are only downcast. Quantised modes map
+    [low, high] linearly onto codes 0 to top, values outside are
+    clipped and NaN becomes the sentinel code top + 1. The mode,
+    scale and offset are recorded as columns so that codes can
+    be decoded into physical values. In rgba mode images are
+    coloured with a lookup table
+
+    :param mode: float32, uint8, uint16 or rgba
+    :param low: physical value of code 0
+    :param high: physical value of code top
+    :param lut: packed colours, see lut()
+    """
+    images = data["image"]
+    scale, offset = 1., 0.
+    if mode == "float32":
+        images = [np.ascontiguousarray(image, dtype=np.float32)
+                  for image in images]
+    elif mode == "rgba":
+        images = [colour(image, lut, low, high) for image in images]
+    else:
+        if low is not None:
+            offset = low
+        if (low is not None) and (high is not None) and (high > low):
+            scale = (high - low) / (sentinel(mode) - 1)
+        images = [quantise(image, DTYPES[mode], scale, offset)
+                  for image in images]
+    n = len(images)
+    return dict(data, **{
+        "image": images,
+        "encoding": [mode] * n,
+        "scale": [scale] * n,
+        "offset": [offset] * n
+    })
+
+
+def quantise(values, dtype, scale, offset):
+    code = sentinel(dtype)
+    codes = (np.asarray(values, dtype=np.float32) - offset) / scale
+    np.clip(codes, 0, code - 1, out=codes)
+    np.rint(codes, out=codes)
+    codes[np.isnan(codes)] = code
+    return codes.astype(dtype)
+
+
+def decode(data, i=0):
+    """Physical values of the i-th image, NaN for the sentinel"""
+    values = data["image"][i]
+    mode = data.get("encoding", ["float32"])[i]
+    if mode == "float32":
+        return np.asarray(values, dtype=np.float32)
+    result = data["offset"][i] + data["scale"][i] * values.astype(np.float32)
+    result[values == sentinel(mode)] = np.nan
+    return result
+
+
+def colour(values, lut, low, high):
+    """Packed RGBA image coloured as LinearColorMapper would
+
+    Values are binned evenly between low and high into the palette
+    entries of the lookup table, NaN takes its last entry
+    """
+    n = len(lut) - 1
+    factor = n / (high - low) if high > low else 0.
+    index = (np.asarray(values, dtype=np.float32) - low) * factor
+    np.floor(index, out=index)
+    np.clip(index, 0, n - 1, out=index)
+    index[np.isnan(index)] = n
+    return np.take(lut, index.astype(np.intp))
+
+
+def lut(palette, nan_color=0):
+    """Packed RGBA palette followed by the NaN colour
+
+    Tables are shared by every document using the same palette,
+    the colour mapper's limits are applied when indexing
+
+    :param palette: list of "#rrggbb" colours
+    :param nan_color: packed uint32 colour of NaN
+    """
+    key = (tuple(palette), nan_color)
+    if key not in LUTS:
+        LUTS[key] = np.append(
+            pack(palette), np.uint32(nan_color)).astype(np.uint32)
+    return LUTS[key]
+
+
+def pack(colors):
+    """Opaque "#rrggbb" colours as uint32 with bytes in RGBA order"""
+    rgba = np.full((len(colors), 4), 255, dtype=np.uint8)
+    for i, color in enumerate(colors):
+        rgba[i, :3] = [int(color[j:j + 2], 16) for j in (1, 3, 5)]
+    return rgba.view(np.uint32)[:, 0]
+
+
+def sentinel(mode):
+    """Code reserved for NaN in a quantised mode"""
+    return np.iinfo(DTYPES.get(mode, mode)).max
+
@@ -1,27 +1,84 @@
-import cartopy
 import numpy as np
 
 
+RADIUS = 6378137.  # Web mercator sphere in metres
+WORLD_WIDTH = 2 * np.pi * RADIUS  # Web mercator extent in metres
+
+
 def to_180(x):
     y = x.copy()
     y[y > 180.] -= 360.
     return y
 
 
-def web_mercator(lons, lats):
-    return transform(
-            lons,
-            lats,
-            cartopy.crs.PlateCarree(),
-            cartopy.crs.Mercator.GOOGLE)
+def web_mercator(lons, lats, dtype=None, out=None):
+    """Spherical web mercator x, y in metres
+
+    Closed form equivalent of transforming from PlateCarree to
+    cartopy.crs.Mercator.GOOGLE. Longitudes outside [-180, 180]
+    are wrapped as cartopy does. For latitudes within 89 degrees
+    of the equator results agree with cartopy to 1e-5 m in float64
+    and to a relative error of 1e-6 in float32. Unlike cartopy, a
+    NaN in one coordinate does not propagate to the other
+
+    :param dtype: float32 or float64, defaults to float32 if both
+                  inputs are float32 and float64 otherwise
+    :param out: optional pair of arrays to write x, y into
+    :returns: flattened x, y arrays
+    """
+    lons, lats, (x, y) = _arrays(lons, lats, dtype, out)
+    _wrap(lons, out=x)
+    np.multiply(x, RADIUS * np.pi / 180., out=x)
+    np.multiply(lats, np.pi / 180., out=y)
+    np.tan(y, out=y)
+    np.arcsinh(y, out=y)
+    np.multiply(y, RADIUS, out=y)
+    return x, y
+
+
+def plate_carree(x, y, dtype=None, out=None):
+    """Longitudes, latitudes in degrees from web mercator x, y
+
+    Inverse of web_mercator with the same tolerance, longitudes
+    are wrapped into [-180, 180]
+
+    :param dtype: float32 or float64, defaults to float32 if both
+                  inputs are float32 and float64 otherwise
+    :param out: optional pair of arrays to write lons, lats into
+    :returns: flattened lons, lats arrays
+    """
+    x, y, (lons, lats) = _arrays(x, y, dtype, out)
+    np.multiply(x, 180. / (np.pi * RADIUS), out=lons)
+    _wrap(lons, out=lons)
+    np.multiply(y, 1. / RADIUS, out=lats)
+    with np.errstate(over="ignore", invalid="ignore"):
+        np.sinh(lats, out=lats)
+    np.arctan(lats, out=lats)
+    np.multiply(lats, 180. / np.pi, out=lats)
+    return lons, lats
+
+
+def _arrays(a, b, dtype, out):
+    a, b = np.asarray(a).ravel(), np.asarray(b).ravel()
+    if dtype is None:
+        if (a.dtype == np.float32) and (b.dtype == np.float32):
+            dtype = np.float32
+        else:
+            dtype = np.float64
+    if out is None:
+        out = np.empty(a.shape, dtype=dtype), np.empty(b.shape, dtype=dtype)
+    return a, b, out
 
 
-def plate_carree(x, y):
-    return transform(
-            x,
-            y,
-            cartopy.crs.Mercator.GOOGLE,
-            cartopy.crs.PlateCarree())
+def _wrap(lons, out):
+    """Wrap longitudes into [-180, 180] keeping +/-180 as given"""
+    np.copyto(out, lons, casting="unsafe")
+    with np.errstate(invalid="ignore"):
+        outside = np.abs(out) > 180.
+    if outside.any():
+        values = out[outside]
+        out[outside] = values - 360. * np.floor((values + 180.) / 360.)
+    return out
 
 
 def transform(x, y, src_crs, dst_crs):
@@ -87,7 +87,13 @@ class Controls(Observable):
         return wrapper
 
     def render(self):
-        self.announce(self.combine(self.models, self.flags))
+        """Announce the combined state if it changed"""
+        state = {k: list(v) for k, v in
+                 self.combine(self.models, self.flags).items()}
+        if state == self.previous_state:
+            return
+        self.previous_state = state
+        self.announce(state)
 
     @staticmethod
     def combine(models, flags):
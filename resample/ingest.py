@@ -0,0 +1,66 @@
+"""Copy model files matched by the server's patterns into a chunked store
+
+Each variable of each file is written by a pool of worker
+processes. The server reads ingested copies in place of the files
+
+Usage: python ingest.py [--workers N] [--zlib] [--complevel L]
+                        [--directory DIR] [NAME ...]
+"""
+import sys
+import argparse
+import glob
+import netCDF4
+from concurrent.futures import ProcessPoolExecutor
+import data
+import server_lifecycle
+from store import ChunkedStore
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("names", nargs="*",
+                        help="patterns to ingest, default all model data")
+    parser.add_argument("--directory", default=server_lifecycle.STORE_DIR)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--zlib", action="store_true")
+    parser.add_argument("--complevel", type=int, default=4)
+    return parser.parse_args(args=argv)
+
+
+def jobs(patterns, names=None):
+    """(path, variable) pairs of the files UMLoader would read"""
+    result = []
+    for name, pattern in patterns.items():
+        if (names is not None) and (name not in names):
+            continue
+        if data.loader_class(name) is not data.UMLoader:
+            continue
+        for path in sorted(glob.glob(pattern)):
+            with netCDF4.Dataset(path) as dataset:
+                for variable in data.UMLoader.load_variables(dataset):
+                    dimensions = dataset.variables[variable].dimensions
+                    if (len(dimensions) >= 3 and
+                            dimensions[0].startswith("time")):
+                        result.append((path, variable))
+    return result
+
+
+def write(directory, path, variable, zlib, complevel):
+    return ChunkedStore(directory).write(
+        path, variable, zlib=zlib, complevel=complevel)
+
+
+def main(argv):
+    args = parse_args(argv)
+    todo = jobs(server_lifecycle.PATTERNS, args.names or None)
+    print("{} variables to ingest".format(len(todo)))
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(
+            write, args.directory, path, variable, args.zlib, args.complevel)
+            for path, variable in todo]
+        for future in futures:
+            print("written: {}".format(future.result()))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,188 @@
+"""Columnar, indexed store of EarthNetworks lightning flashes"""
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+import cache
+
+
+FLASH_TYPES = np.array(["CG", "IC", "Keep alive", "Unknown"], dtype=object)
+CODES = ["0", "1", "9"]
+DTYPES = {
+    "flash_type": np.int8,
+    "time": np.int64,
+    "latitude": np.float32,
+    "longitude": np.float32
+}
+
+
+def parse(csv_file):
+    """Read an EarthNetworks CSV into compact columns
+
+    Flash types become int8 category codes, unrecognised types
+    are coded -1, times become int64 nanoseconds since epoch
+    """
+    frame = pd.read_csv(
+        csv_file,
+        usecols=[0, 1, 2, 3],
+        names=["flash_type", "date", "latitude", "longitude"],
+        dtype={"flash_type": str},
+        header=None)
+    codes = pd.Categorical(frame["flash_type"], categories=CODES).codes
+    return {
+        "flash_type": codes.astype(np.int8),
+        "time": pd.to_datetime(frame["date"]).values.astype("int64"),
+        "latitude": frame["latitude"].values.astype(np.float32),
+        "longitude": frame["longitude"].values.astype(np.float32)
+    }
+
+
+def load(csv_file, directory=None):
+    """Parse a CSV file, reusing a binary columnar cache if possible"""
+    if directory is None:
+        return parse(csv_file)
+    path = cache.stem(directory, csv_file, "lightning") + ".npz"
+    try:
+        with np.load(path) as columns:
+            return dict(columns)
+    except (IOError, ValueError):
+        pass
+    columns = parse(csv_file)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as stream:
+            np.savez(stream, **columns)
+        os.replace(tmp, path)
+    except Exception:
+        os.remove(tmp)
+        raise
+    return columns
+
+
+class Flashes(object):
+    """Flashes sorted by time with a coarse latitude/longitude grid
+
+    Time windows are found by binary search. Each grid row of a
+    bounding box is a contiguous run of the cell-sorted index, so
+    small boxes only visit the flashes inside their cells
+
+    :param columns: dict of flash_type, time, latitude, longitude
+    :param cell: grid spacing in degrees
+    """
+    def __init__(self, columns, cell=1.):
+        order = np.argsort(columns["time"], kind="stable")
+        self.columns = {k: np.asarray(v)[order] for k, v in columns.items()}
+        self.cell = cell
+        self.nrows = int(np.ceil(180. / cell))
+        self.ncols = int(np.ceil(360. / cell))
+        cells = self.cells(
+            self.columns["longitude"],
+            self.columns["latitude"])
+        self.cell_order = np.argsort(cells, kind="stable")
+        self.cell_starts = np.searchsorted(
+            cells[self.cell_order],
+            np.arange(self.nrows * self.ncols + 1))
+
+    @classmethod
+    def concat(cls, columns, cell=1.):
+        return cls({k: np.concatenate(
+                        [np.zeros(0, dtype=dtype)] + [c[k] for c in columns])
+                    for k, dtype in DTYPES.items()}, cell=cell)
+
+    def __len__(self):
+        return len(self.columns["time"])
+
+    def rows(self, latitudes):
+        return np.clip(
+            ((np.asarray(latitudes) + 90.) // self.cell).astype(int),
+            0, self.nrows - 1)
+
+    def cols(self, longitudes):
+        return np.clip(
+            ((np.asarray(longitudes) + 180.) // self.cell).astype(int),
+            0, self.ncols - 1)
+
+    def cells(self, longitudes, latitudes):
+        return self.rows(latitudes) * self.ncols + self.cols(longitudes)
+
+    def query(self, start=None, end=None, bbox=None):
+        """Flashes in a time window and lon/lat box
+
+        :param start: numpy.datetime64 inclusive lower bound
+        :param end: numpy.datetime64 exclusive upper bound
+        :param bbox: (lon0, lat0, lon1, lat1)
+        :returns: dict of date, longitude, latitude, flash_type arrays
+        """
+        index = self.index(start, end, bbox)
+        return {
+            "date": self.columns["time"][index].astype("datetime64[ns]"),
+            "longitude": self.columns["longitude"][index],
+            "latitude": self.columns["latitude"][index],
+            "flash_type": FLASH_TYPES[self.columns["flash_type"][index]]
+        }
+
+    def count(self, start=None, end=None, bbox=None):
+        """Number of flashes query would return"""
+        index = self.index(start, end, bbox)
+        if isinstance(index, slice):
+            return index.stop - index.start
+        return len(index)
+
+    def index(self, start=None, end=None, bbox=None):
+        """Positions of flashes in a time window and lon/lat box
+
+        A box covering the globe is ignored, so a time window alone
+        is a slice found by binary search
+        """
+        times = self.columns["time"]
+        lo = 0 if start is None else np.searchsorted(
+            times, np.datetime64(start, "ns").astype("int64"), "left")
+        hi = len(times) if end is None else np.searchsorted(
+            times, np.datetime64(end, "ns").astype("int64"), "left")
+        if (bbox is not None) and global_box(bbox):
+            bbox = None
+        if bbox is None:
+            return slice(lo, hi)
+        lon0, lat0, lon1, lat1 = bbox
+        c0, c1 = self.cols([lon0, lon1])
+        r0, r1 = self.rows([lat0, lat1])
+        candidates = (self.cell_starts[(r1 + 1) * self.ncols] -
+                      self.cell_starts[r0 * self.ncols])
+        if candidates < (hi - lo):
+            runs = [self.cell_order[
+                self.cell_starts[r * self.ncols + c0]:
+                self.cell_starts[r * self.ncols + c1 + 1]]
+                for r in range(r0, r1 + 1)]
+            index = np.sort(np.concatenate(runs))
+            index = index[(index >= lo) & (index < hi)]
+        else:
+            index = np.arange(lo, hi)
+        lons = self.columns["longitude"][index]
+        lats = self.columns["latitude"][index]
+        inside = ((lons >= lon0) & (lons <= lon1) &
+                  (lats >= lat0) & (lats <= lat1))
+        return index[inside]
+
+
+def global_box(bbox):
+    """True if a (lon0, lat0, lon1, lat1) box covers the globe"""
+    lon0, lat0, lon1, lat1 = bbox
+    return (lon0 <= -180) and (lon1 >= 180) and (lat0 <= -90) and (lat1 >= 90)
+
+
+def aggregate(x, y, size):
+    """Count points in square cells aligned to multiples of size
+
+    Cells are aligned to the origin rather than the viewport, so
+    counts at a given size can be reused while panning
+
+    :returns: cell centres x, y and counts
+    """
+    offset = 2**30
+    ix = np.floor(np.asarray(x) / size).astype(np.int64) + offset
+    iy = np.floor(np.asarray(y) / size).astype(np.int64) + offset
+    keys, counts = np.unique((ix << 31) | iy, return_counts=True)
+    ix = (keys >> 31) - offset
+    iy = (keys & (2**31 - 1)) - offset
+    return (ix + 0.5) * size, (iy + 0.5) * size, counts
@@ -0,0 +1,97 @@
+"""Simplified copies of map lines for each zoom level"""
+import numpy as np
+import shapely.geometry
+import geo
+
+
+TILE_PIXELS = 256
+
+
+class Level(object):
+    """Lines packed into float32 arrays with per-line bounds"""
+    def __init__(self, lines, tolerance):
+        self.tolerance = tolerance
+        lengths = [len(x) for x, _ in lines]
+        self.starts = np.cumsum([0] + lengths)
+        if len(lines) > 0:
+            self.x = np.concatenate([x for x, _ in lines]).astype(np.float32)
+            self.y = np.concatenate([y for _, y in lines]).astype(np.float32)
+            self.bounds = np.array([
+                (x.min(), y.min(), x.max(), y.max())
+                for x, y in lines], dtype=np.float32)
+        else:
+            self.x = np.zeros(0, dtype=np.float32)
+            self.y = np.zeros(0, dtype=np.float32)
+            self.bounds = np.zeros((0, 4), dtype=np.float32)
+
+    @property
+    def nbytes(self):
+        return (self.x.nbytes + self.y.nbytes +
+                self.starts.nbytes + self.bounds.nbytes)
+
+    def query(self, bbox=None):
+        """Lines overlapping a web mercator (x0, y0, x1, y1) box"""
+        if bbox is None:
+            index = np.arange(len(self.bounds))
+        else:
+            x0, y0, x1, y1 = bbox
+            index, = np.nonzero(
+                (self.bounds[:, 0] <= x1) & (self.bounds[:, 2] >= x0) &
+                (self.bounds[:, 1] <= y1) & (self.bounds[:, 3] >= y0))
+        starts, ends = self.starts[index], self.starts[index + 1]
+        return {
+            "xs": [self.x[s:e] for s, e in zip(starts, ends)],
+            "ys": [self.y[s:e] for s, e in zip(starts, ends)]
+        }
+
+
+class Lines(object):
+    """Douglas-Peucker simplified lines for zoom levels 0 to max_level
+
+    The tolerance at each level is one web mercator pixel at that
+    zoom, so simplification is invisible on screen. Lines smaller
+    than a pixel are dropped. A final level keeps full resolution
+
+    :param lines: list of web mercator (x, y) arrays
+    :param max_level: deepest simplified zoom level
+    """
+    def __init__(self, lines, max_level=8):
+        self.levels = []
+        for level in range(max_level + 1):
+            tolerance = pixel_size(level)
+            self.levels.append(Level(
+                simplify(lines, tolerance), tolerance))
+        self.levels.append(Level(lines, 0.))
+
+    @property
+    def nbytes(self):
+        return sum(level.nbytes for level in self.levels)
+
+    def level(self, pixel):
+        """Coarsest level whose tolerance is below a pixel size"""
+        for level in self.levels:
+            if level.tolerance <= pixel:
+                return level
+        return self.levels[-1]
+
+    def query(self, pixel, bbox=None):
+        return self.level(pixel).query(bbox)
+
+
+def pixel_size(level):
+    """Width of a web mercator tile pixel in metres at a zoom level"""
+    return geo.WORLD_WIDTH / (TILE_PIXELS * 2**level)
+
+
+def simplify(lines, tolerance):
+    result = []
+    for x, y in lines:
+        if max(np.ptp(x), np.ptp(y)) < tolerance:
+            continue
+        line = shapely.geometry.LineString(np.column_stack([x, y]))
+        line = line.simplify(tolerance, preserve_topology=False)
+        if line.is_empty:
+            continue
+        x, y = np.asarray(line.coords).T
+        result.append((x, y))
+    return result
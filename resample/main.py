@@ -1,12 +1,14 @@
 from enum import Enum
 import bokeh.plotting
 import bokeh.events
-import numpy as np
 import os
 import data
 import view
 import images
 import geo
+import summary
+from collections import OrderedDict
+from functools import partial
 from util import Observable, select
 
 
@@ -89,15 +91,16 @@ def main():
             bar_line_color="black")
         figure.add_layout(colorbar, 'center')
 
-    artist = Artist(figures, color_mapper)
+    artist = Artist(figures, color_mapper, encoding=data.ENCODING,
+            viewport=data.VIEWPORT)
     renderers = []
     for _, r in artist.renderers.items():
         renderers += r
 
-    image_sources = []
+    encoders = []
     for name, viewer in artist.viewers.items():
         if isinstance(viewer, (view.UMView, view.GPMView)):
-            image_sources.append(viewer.source)
+            encoders.append(viewer.encoder)
 
     image_loaders = []
     for name, loader in data.LOADERS.items():
@@ -105,10 +108,11 @@ def main():
             image_loaders.append(loader)
 
     features = []
-    for figure in figures:
-        features += [
-            add_feature(figure, data.COASTLINES),
-            add_feature(figure, data.BORDERS)]
+    for lines in [data.COASTLINES, data.BORDERS]:
+        feature = view.Lines(lines)
+        for figure in figures:
+            features.append(feature.add_figure(figure))
+        feature.viewport.update()
     toggle = bokeh.models.CheckboxButtonGroup(
             labels=["Coastlines"],
             active=[0],
@@ -163,7 +167,7 @@ def main():
             color_mapper,
             palettes)
 
-    mapper_limits = MapperLimits(image_sources, color_mapper)
+    mapper_limits = MapperLimits(encoders, color_mapper)
 
     menu = [(n, n) for n in data.FILE_DB.names]
     image_controls = images.Controls(menu)
@@ -215,6 +219,7 @@ def main():
                 bokeh.layouts.row(mapper_limits.low_input),
                 bokeh.layouts.row(mapper_limits.high_input),
                 bokeh.layouts.row(mapper_limits.checkbox),
+                bokeh.layouts.row(mapper_limits.drop),
                 ),
             title="Settings")
         ])
@@ -266,8 +271,20 @@ from itertools import cycle
 
 
 class Series(object):
-    def __init__(self, figure):
+    """Time series at a tapped point for every model
+
+    Each model is read concurrently on the shared executor and its
+    line is updated as soon as it arrives. A new tap cancels reads
+    still queued for the previous one, reads that miss the deadline
+    are abandoned and their lines cleared
+
+    :param deadline: milliseconds to wait for all models
+    """
+    def __init__(self, figure, deadline=5000):
         self.figure = figure
+        self.deadline = deadline
+        self.futures = {}
+        self.timeout = None
         self.sources = {}
         items = []
         colors = cycle(bokeh.palettes.Colorblind[6][::-1])
@@ -313,9 +330,47 @@ class Series(object):
         if any_none(self, ["x", "y", "variable"]):
                 return
         self.figure.title.text = self.variable
-        for name, source in self.sources.items():
-            loader = data.LOADERS[name]
-            source.data = loader.series(self.variable, self.x, self.y, self.ipressure)
+        self.cancel()
+        document = bokeh.plotting.curdoc()
+        self.timeout = document.add_timeout_callback(
+                self.on_deadline, self.deadline)
+        for name in self.sources:
+            future = data.LOADERS[name].series_async(
+                    self.variable, self.x, self.y, self.ipressure)
+            self.futures[name] = future
+            future.add_done_callback(
+                lambda f, name=name: document.add_next_tick_callback(
+                    partial(self.on_series, name, f)))
+
+    def on_series(self, name, future):
+        if self.futures.get(name) is not future:
+            return  # Superseded or abandoned
+        del self.futures[name]
+        try:
+            self.sources[name].data = future.result()
+        except Exception as e:
+            print("series failed: {} {}".format(name, e))
+        if len(self.futures) == 0:
+            self.cancel()
+
+    def on_deadline(self):
+        self.timeout = None
+        for name in self.futures:
+            print("series timed out: {}".format(name))
+            self.sources[name].data = {"x": [], "y": []}
+        self.cancel()
+
+    def cancel(self):
+        """Forget outstanding reads, cancelling those not started"""
+        for future in self.futures.values():
+            future.cancel()
+        self.futures = {}
+        if self.timeout is not None:
+            try:
+                bokeh.plotting.curdoc().remove_timeout_callback(self.timeout)
+            except ValueError:
+                pass  # Already fired
+            self.timeout = None
 
 
 def any_none(obj, attrs):
@@ -323,11 +378,16 @@ def any_none(obj, attrs):
 
 
 class Artist(object):
-    def __init__(self, figures, color_mapper):
+    def __init__(self, figures, color_mapper, encoding="float32",
+                 viewport=False):
         self.figures = figures
         self.color_mapper = color_mapper
+        self.encoding = encoding
+        self.viewport = viewport
         self.viewers = {}
         self.renderers = {}
+        self.rendered = {}
+        self.pending = False
         self.previous_state = None
         self.variable = None
         self.ipressure = 0
@@ -338,9 +398,12 @@ class Artist(object):
             elif isinstance(loader, data.EarthNetworks):
                 viewer = view.EarthNetworks(loader)
             elif isinstance(loader, data.GPM):
-                viewer = view.GPMView(loader, self.color_mapper)
+                viewer = view.GPMView(
+                        loader, self.color_mapper, self.encoding, data.IMAGES)
             else:
-                viewer = view.UMView(loader, self.color_mapper)
+                viewer = view.UMView(
+                        loader, self.color_mapper, self.encoding, data.IMAGES,
+                        viewport=self.viewport)
             self.viewers[name] = viewer
             self.renderers[name] = [
                     viewer.add_figure(f)
@@ -366,7 +429,7 @@ class Artist(object):
             self.renderers[i][j].visible = True
 
         self.previous_state = dict(state)
-        self.render()
+        self.schedule()
 
     @staticmethod
     def flatten(state):
@@ -379,15 +442,65 @@ class Artist(object):
         self.variable = variable
         self.ipressure = ipressure
         self.itime = itime
-        self.render()
+        self.schedule()
+
+    def schedule(self):
+        """Coalesce control events into one render per tick"""
+        if self.pending:
+            return
+        self.pending = True
+        bokeh.plotting.curdoc().add_next_tick_callback(self.render)
 
     def render(self):
+        """Render visible views whose inputs changed since last time
+
+        Hidden views drop their summaries, so they do not count
+        towards auto-ranging, and are rendered afresh when shown
+        """
+        self.pending = False
         if self.previous_state is None:
             return
-        for name in self.previous_state:
-            viewer = self.viewers[name]
+        for name, viewer in self.viewers.items():
+            if not any(self.previous_state.get(name, [])):
+                self.rendered.pop(name, None)
+                if isinstance(viewer, (view.UMView, view.GPMView)):
+                    viewer.encoder.hide()
+                continue
             if isinstance(viewer, view.UMView):
-                viewer.render(self.variable, self.ipressure, self.itime)
+                args = (self.variable, self.ipressure, self.itime)
+            elif isinstance(viewer, view.GPMView):
+                args = (self.variable, self.valid_time())
+            elif isinstance(viewer, view.RDT):
+                args = (self.valid_time(),)
+            else:
+                continue
+            if self.rendered.get(name) == args:
+                continue
+            self.rendered[name] = args
+            future = viewer.render(*args)
+            if future is not None:
+                document = bokeh.plotting.curdoc()
+                future.add_done_callback(
+                    lambda f, name=name, args=args:
+                        document.add_next_tick_callback(
+                            partial(self.on_load, name, args, f)))
+
+    def on_load(self, name, args, future):
+        """Forget failed loads so the next render retries them"""
+        if future.cancelled() or (future.exception() is not None):
+            if self.rendered.get(name) == args:
+                del self.rendered[name]
+
+    def valid_time(self):
+        """Validity time of the selected field on the first UM model"""
+        for loader in data.LOADERS.values():
+            if isinstance(loader, data.UMLoader):
+                try:
+                    _, metadata = loader.metadata(
+                            self.variable, self.ipressure, self.itime)
+                except (KeyError, IndexError):
+                    return None
+                return metadata["valid"][0]
 
 
 class FieldControls(Observable):
@@ -484,11 +597,26 @@ class TimeControls(Observable):
 
 
 class MapperLimits(object):
-    def __init__(self, sources, color_mapper, fixed=False):
+    """Colour mapper limits, set automatically unless fixed
+
+    Auto-ranging uses the summary each view.Encoder announces for
+    its image, so it does not depend on how images are encoded and
+    never visits pixels. Percentile ranges use the exact percentiles
+    stored in each summary so single outliers do not dominate
+    """
+    ranges = OrderedDict([
+        ("Min/max", (0, 100)),
+        ("1-99%", (1, 99)),
+        ("2-98%", (2, 98)),
+        ("5-95%", (5, 95))])
+
+    def __init__(self, encoders, color_mapper, fixed=False,
+                 auto="Min/max"):
         self.fixed = fixed
-        self.sources = sources
-        for source in self.sources:
-            source.on_change("data", self.on_source_change)
+        self.auto = auto
+        self.summaries = {}
+        for i, encoder in enumerate(encoders):
+            encoder.subscribe(partial(self.on_summary, i))
         self.color_mapper = color_mapper
         self.low_input = bokeh.models.TextInput(title="Low:")
         self.low_input.on_change("value",
@@ -504,6 +632,11 @@ class MapperLimits(object):
                 labels=["Fixed"],
                 active=[])
         self.checkbox.on_change("active", self.on_checkbox_change)
+        self.drop = bokeh.models.Dropdown(
+                label=auto,
+                menu=[(k, k) for k in self.ranges.keys()])
+        self.drop.on_click(change_label(self.drop))
+        self.drop.on_click(self.on_auto)
 
     def on_checkbox_change(self, attr, old, new):
         if len(new) == 1:
@@ -511,19 +644,25 @@ class MapperLimits(object):
         else:
             self.fixed = False
 
-    def on_source_change(self, attr, old, new):
+    def on_summary(self, i, image_summary):
+        if image_summary is None:
+            self.summaries.pop(i, None)
+        else:
+            self.summaries[i] = image_summary
+        self.autorange()
+
+    def on_auto(self, value):
+        self.auto = value
+        self.autorange()
+
+    def autorange(self):
         if self.fixed:
             return
-        images = []
-        for source in self.sources:
-            if len(source.data["image"]) == 0:
-                continue
-            images.append(source.data["image"][0])
-        if len(images) > 0:
-            low = np.min([np.min(x) for x in images])
-            high = np.max([np.max(x) for x in images])
-            self.color_mapper.low = low
-            self.color_mapper.high = high
+        limits = summary.limits(
+                self.summaries.values(), *self.ranges[self.auto])
+        if limits is None:
+            return
+        self.color_mapper.low, self.color_mapper.high = limits
 
     @staticmethod
     def change(widget, prop, dtype):
@@ -566,14 +705,5 @@ def change(widget, prop, dtype):
     return wrapper
 
 
-def add_feature(figure, data):
-    source = bokeh.models.ColumnDataSource(data)
-    return figure.multi_line(
-        xs="xs",
-        ys="ys",
-        source=source,
-        color="white")
-
-
 if __name__.startswith("bk"):
     main()
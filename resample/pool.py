@@ -0,0 +1,97 @@
+"""Process-wide pool of open netCDF4 datasets"""
+import os
+import threading
+import contextlib
+import netCDF4
+from collections import OrderedDict
+
+
+# netCDF-C is not thread-safe and netCDF4 releases the GIL around
+# its calls, so every open, read and close in the process holds this
+LOCK = threading.RLock()
+
+
+class Handle(object):
+    def __init__(self, dataset, mtime):
+        self.dataset = dataset
+        self.mtime = mtime
+        self.users = 0
+        self.stale = False
+
+    def close(self):
+        self.dataset.close()
+
+
+class DatasetPool(object):
+    """Share open netCDF4.Dataset handles between loaders
+
+    Handles are keyed by path and reopened if the file's mtime
+    changes. At most ``max_open`` idle handles are kept, the
+    least recently used are closed first
+
+    The pool may be shared between threads. Opening, closing and
+    the body of each dataset block run under the module LOCK, so
+    only one thread calls into netCDF-C at a time. Blocks should
+    only read, decoding and other work belongs outside them
+
+    :param max_open: maximum number of open files
+    """
+    def __init__(self, max_open=16):
+        self.max_open = max_open
+        self._lock = threading.Lock()
+        self._handles = OrderedDict()
+
+    @contextlib.contextmanager
+    def dataset(self, path):
+        """Borrow an open dataset for the duration of a with block"""
+        handle = self._acquire(path)
+        try:
+            with LOCK:
+                yield handle.dataset
+        finally:
+            self._release(handle)
+
+    def __len__(self):
+        return len(self._handles)
+
+    def close(self):
+        """Close every idle handle"""
+        with LOCK, self._lock:
+            for path in list(self._handles.keys()):
+                self._discard(path)
+
+    def _acquire(self, path):
+        mtime = os.stat(path).st_mtime_ns
+        with LOCK, self._lock:
+            handle = self._handles.get(path)
+            if (handle is not None) and (handle.mtime != mtime):
+                self._discard(path)
+                handle = None
+            if handle is None:
+                handle = Handle(netCDF4.Dataset(path), mtime)
+                self._handles[path] = handle
+            handle.users += 1
+            self._handles.move_to_end(path)
+            self._close_idle()
+            return handle
+
+    def _release(self, handle):
+        with LOCK, self._lock:
+            handle.users -= 1
+            if handle.stale and handle.users == 0:
+                handle.close()
+            else:
+                self._close_idle()
+
+    def _discard(self, path):
+        handle = self._handles.pop(path)
+        handle.stale = True
+        if handle.users == 0:
+            handle.close()
+
+    def _close_idle(self):
+        for path in list(self._handles.keys()):
+            if len(self._handles) <= self.max_open:
+                break
+            if self._handles[path].users == 0:
+                self._discard(path)
@@ -0,0 +1,86 @@
+"""Speculative loading of neighbouring fields"""
+import queue
+import threading
+
+
+class Prefetcher(object):
+    """Warm the image cache in the background
+
+    A single worker thread drains a bounded queue of keys, so
+    speculative loads never compete with more than one of the
+    interactive loads. Requests for a new variable cancel queued
+    keys of the previous variable on the same file. Prefetched
+    images may evict least recently used entries, but keys that
+    the budget left over by pinned entries cannot hold are skipped.
+    One key is loaded at a time, so at most one image is in flight
+
+    :param load: function(path, variable, ipressure, itime)
+    :param cache: ImageCache to warm
+    :param steps: number of time steps either side to prefetch
+    :param maxsize: maximum number of queued keys
+    """
+    def __init__(self, load, cache, steps=2, maxsize=16):
+        self.load = load
+        self.cache = cache
+        self.steps = steps
+        self.queue = queue.Queue(maxsize)
+        self.variables = {}
+        self.generations = {}
+        self._lock = threading.Lock()
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    def prefetch(self, path, variable, indices, nbytes=0):
+        """Queue (itime, ipressure) indices of a variable
+
+        :param nbytes: estimated size of each image
+        """
+        with self._lock:
+            if self.variables.get(path) != variable:
+                self.variables[path] = variable
+                self.generations[path] = self.generations.get(path, 0) + 1
+                self._drop(path)
+            generation = self.generations[path]
+        for itime, ipressure in indices:
+            key = (path, variable, ipressure, itime)
+            if key in self.cache:
+                continue
+            try:
+                self.queue.put_nowait((generation, key, nbytes))
+            except queue.Full:
+                break
+
+    def cancel(self, path):
+        with self._lock:
+            self.variables.pop(path, None)
+            self.generations[path] = self.generations.get(path, 0) + 1
+            self._drop(path)
+
+    def _drop(self, path):
+        kept = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item[1][0] != path:
+                kept.append(item)
+        for item in kept:
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                break
+
+    def work(self):
+        while True:
+            generation, key, nbytes = self.queue.get()
+            if generation != self.generations.get(key[0]):
+                continue
+            if key in self.cache:
+                continue
+            if not self.cache.fits(nbytes):
+                continue
+            try:
+                self.load(*key)
+            except Exception as e:
+                print("prefetch failed: {} {}".format(key, e))
@@ -0,0 +1,75 @@
+"""Block-averaged image pyramids and screen-sized windows"""
+import numpy as np
+
+
+TILE = 64  # Windows are snapped to multiples of this many pixels
+
+
+def downsample(image):
+    """Average 2x2 blocks ignoring NaN, odd edges are padded with NaN"""
+    image = np.asarray(image, dtype=np.float32)
+    ny, nx = image.shape
+    padded = np.full((ny + ny % 2, nx + nx % 2), np.nan, dtype=np.float32)
+    padded[:ny, :nx] = image
+    blocks = padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2)
+    valid = ~np.isnan(blocks)
+    count = valid.sum(axis=(1, 3))
+    total = np.where(valid, blocks, 0).sum(axis=(1, 3))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (total / count).astype(np.float32)
+
+
+def level(data, pixel):
+    """Coarsest pyramid level whose pixels are no wider than pixel"""
+    ny, nx = np.shape(data["image"][0])
+    width = data["dw"][0] / nx
+    if (pixel <= width) or (nx == 0):
+        return 0
+    deepest = int(np.ceil(np.log2(max(nx, ny))))
+    return int(min(np.floor(np.log2(pixel / width)), deepest))
+
+
+def window(data, level, bbox):
+    """Tile-snapped pixel window covering a web mercator box
+
+    :param level: pyramid level the window indexes
+    :param bbox: (x0, y0, x1, y1)
+    :returns: (j0, j1, i0, i1) rows and columns at that level
+    """
+    ny, nx = np.shape(data["image"][0])
+    factor = 2**level
+    px = factor * data["dw"][0] / nx
+    py = factor * data["dh"][0] / ny
+    x0, y0, x1, y1 = bbox
+    i0 = int(np.floor((x0 - data["x"][0]) / px / TILE)) * TILE
+    i1 = int(np.ceil((x1 - data["x"][0]) / px / TILE)) * TILE
+    j0 = int(np.floor((y0 - data["y"][0]) / py / TILE)) * TILE
+    j1 = int(np.ceil((y1 - data["y"][0]) / py / TILE)) * TILE
+    nx, ny = -(-nx // factor), -(-ny // factor)
+    return (min(max(j0, 0), ny), min(max(j1, 0), ny),
+            min(max(i0, 0), nx), min(max(i1, 0), nx))
+
+
+def crop(data, image, level, window):
+    """Copy of image data showing a window of a pyramid level
+
+    :param image: pyramid image at level
+    """
+    j0, j1, i0, i1 = window
+    ny, nx = np.shape(data["image"][0])
+    factor = 2**level
+    px = factor * data["dw"][0] / nx
+    py = factor * data["dh"][0] / ny
+    return dict(data, **{
+        "x": [data["x"][0] + i0 * px],
+        "y": [data["y"][0] + j0 * py],
+        "dw": [(i1 - i0) * px],
+        "dh": [(j1 - j0) * py],
+        "image": [image[j0:j1, i0:i1]]
+    })
+
+
+def contains(outer, inner):
+    """True if a (j0, j1, i0, i1) window contains another"""
+    return ((outer[0] <= inner[0]) and (inner[1] <= outer[1]) and
+            (outer[2] <= inner[2]) and (inner[3] <= outer[3]))
@@ -3,15 +3,32 @@ import os
 import data
 
 
+CACHE_BYTES = 2 * 1024**3  # Image cache memory budget
+CACHE_DIR = os.path.expanduser("~/.cache/resample")  # Stretched images
+SERIES_DIR = os.path.join(CACHE_DIR, "series")  # Time-major sidecars
+PREFETCH_STEPS = 2  # Time steps either side to load in the background
+POLL_MS = 60 * 1000  # Interval between file catalogue updates
+ENCODING = "float32"  # Image payloads: float32, uint8, uint16 or rgba
+VIEWPORT = False  # Send only the visible window at screen resolution
+STORE_DIR = os.path.join(CACHE_DIR, "store")  # Chunked copies, see ingest.py
+DIRECTORY = "/Users/andrewryan/buckets/stephen-sea-public-london"
+PATTERNS = OrderedDict({
+    "GA6": os.path.join(DIRECTORY, "model_data/highway_ga6*.nc"),
+    "Tropical Africa 4.4km": os.path.join(DIRECTORY, "model_data/highway_takm4p4*.nc"),
+    "East Africa 4.4km": os.path.join(DIRECTORY, "model_data/highway_eakm4p4*.nc"),
+    "RDT": "/Users/andrewryan/cache/*.json",
+    "EarthNetworks": "/Users/andrewryan/buckets/highway-external-collab/englnrt_*",
+    "GPM IMERG early": os.path.join(DIRECTORY, "gpm_imerg/gpm_imerg_NRTearly_V05B_*_highway_only.nc"),
+    "GPM IMERG late": os.path.join(DIRECTORY, "gpm_imerg/gpm_imerg_NRTlate_V05B_*_highway_only.nc"),
+})
+
+
 def on_server_loaded(server_context):
-    directory = "/Users/andrewryan/buckets/stephen-sea-public-london"
-    patterns = OrderedDict({
-        "GA6": os.path.join(directory, "model_data/highway_ga6*.nc"),
-        "Tropical Africa 4.4km": os.path.join(directory, "model_data/highway_takm4p4*.nc"),
-        "East Africa 4.4km": os.path.join(directory, "model_data/highway_eakm4p4*.nc"),
-        "RDT": "/Users/andrewryan/cache/*.json",
-        "EarthNetworks": "/Users/andrewryan/buckets/highway-external-collab/englnrt_*",
-        "GPM IMERG early": os.path.join(directory, "gpm_imerg/gpm_imerg_NRTearly_V05B_*_highway_only.nc"),
-        "GPM IMERG late": os.path.join(directory, "gpm_imerg/gpm_imerg_NRTlate_V05B_*_highway_only.nc"),
-    })
-    data.on_server_loaded(patterns)
+    data.on_server_loaded(PATTERNS, cache_bytes=CACHE_BYTES,
+            cache_dir=CACHE_DIR,
+            prefetch_steps=PREFETCH_STEPS,
+            series_dir=SERIES_DIR,
+            encoding=ENCODING,
+            viewport=VIEWPORT,
+            store_dir=STORE_DIR)
+    server_context.add_periodic_callback(data.poll, POLL_MS)
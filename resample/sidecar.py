@@ -0,0 +1,81 @@
+"""Time-contiguous copies of variables for fast point series"""
+import os
+import tempfile
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+import cache
+
+
+class SeriesStore(object):
+    """Transposed, memory-mapped sidecars per (file, variable)
+
+    A variable shaped (time, ..., latitude, longitude) is written
+    with time as the last, fastest varying axis. A point series is
+    then a single contiguous read however many time steps there are
+
+    Sidecars are built one at a time on a background thread and
+    renamed into place once complete
+
+    :param directory: location of sidecar files
+    :param datasets: DatasetPool used to read source files
+    """
+    def __init__(self, directory, datasets):
+        self.directory = directory
+        self.datasets = datasets
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, path, variable):
+        """Memory-mapped (..., time) array or None if not built"""
+        try:
+            return np.load(self.filename(path, variable), mmap_mode="r")
+        except (IOError, ValueError):
+            return None
+
+    def build_async(self, path, variable):
+        """Schedule a sidecar build unless one is queued already"""
+        filename = self.filename(path, variable)
+        with self._lock:
+            if filename in self.pending:
+                return self.pending[filename]
+            future = self.executor.submit(self.build, path, variable)
+            self.pending[filename] = future
+        future.add_done_callback(
+            lambda f: self.pending.pop(filename, None))
+        return future
+
+    def build(self, path, variable):
+        filename = self.filename(path, variable)
+        if os.path.exists(filename):
+            return filename
+        print("building series sidecar: {} {}".format(path, variable))
+        with self.datasets.dataset(path) as dataset:
+            shape = dataset.variables[variable].shape
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            values = np.lib.format.open_memmap(
+                tmp,
+                mode="w+",
+                dtype=np.float32,
+                shape=shape[1:] + shape[:1])
+            for itime in range(shape[0]):
+                # Release the handle between steps so that
+                # interactive reads can interleave with the build
+                with self.datasets.dataset(path) as dataset:
+                    field = dataset.variables[variable][itime]
+                values[..., itime] = np.ma.filled(
+                    np.ma.asarray(field, dtype=np.float32), np.nan)
+            values.flush()
+            del values
+            os.replace(tmp, filename)
+        except Exception:
+            os.remove(tmp)
+            raise
+        return filename
+
+    def filename(self, path, variable):
+        return cache.stem(self.directory, path, variable) + ".npy"
@@ -0,0 +1,114 @@
+"""Chunked copies of model variables tuned for slices and series"""
+import os
+import tempfile
+import numpy as np
+import netCDF4
+import cache
+
+
+CHUNK_BYTES = 2**20  # Target size of a single chunk
+
+
+class ChunkedStore(object):
+    """One chunked netCDF4 file per (file, variable)
+
+    Copies hold a single variable as float32 with NaN for missing
+    values, alongside the dimension variables it needs. Files are
+    named after the source's path, mtime and size, so modified
+    sources are read directly until they are ingested again
+
+    :param directory: location of the store
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get(self, path, variable):
+        """Path of an ingested copy or None"""
+        try:
+            filename = self.filename(path, variable)
+        except OSError:
+            return None
+        if os.path.exists(filename):
+            return filename
+        return None
+
+    def write(self, path, variable, zlib=False, complevel=4,
+              chunk_bytes=CHUNK_BYTES):
+        """Copy a variable into the store unless already present
+
+        :param zlib: compress chunks
+        :param complevel: zlib compression level 1 to 9
+        :returns: path of the copy
+        """
+        filename = self.filename(path, variable)
+        if os.path.exists(filename):
+            return filename
+        print("ingesting: {} {}".format(path, variable))
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            with netCDF4.Dataset(path) as src, \
+                    netCDF4.Dataset(tmp, "w") as dst:
+                copy(src, dst, variable, zlib, complevel, chunk_bytes)
+            os.replace(tmp, filename)
+        except Exception:
+            os.remove(tmp)
+            raise
+        return filename
+
+    def filename(self, path, variable):
+        return cache.stem(self.directory, path, variable, "chunked") + ".nc"
+
+
+def copy(src, dst, variable, zlib=False, complevel=4,
+         chunk_bytes=CHUNK_BYTES):
+    """Copy a variable and its dimensions between open datasets
+
+    Whole chunks of time steps are written at once, so each chunk
+    is compressed exactly once
+    """
+    var = src.variables[variable]
+    for d in var.dimensions:
+        dst.createDimension(d, len(src.dimensions[d]))
+        if d in src.variables:
+            dim = src.variables[d]
+            out = dst.createVariable(d, dim.dtype, dim.dimensions)
+            out.setncatts({k: dim.getncattr(k) for k in dim.ncattrs()})
+            out[:] = dim[:]
+    chunks = chunk_shape(var.shape, 4, chunk_bytes)
+    out = dst.createVariable(
+        variable,
+        "f4",
+        var.dimensions,
+        zlib=zlib,
+        complevel=complevel,
+        chunksizes=chunks,
+        fill_value=np.nan)
+    out.setncatts({k: var.getncattr(k) for k in var.ncattrs()
+                   if k not in ("_FillValue", "missing_value",
+                                "scale_factor", "add_offset")})
+    for i in range(0, var.shape[0], chunks[0]):
+        out[i:i + chunks[0]] = np.ma.filled(
+            np.ma.asarray(var[i:i + chunks[0]], dtype=np.float32), np.nan)
+
+
+def chunk_shape(shape, itemsize=4, chunk_bytes=CHUNK_BYTES):
+    """Chunks of (time, ..., latitude, longitude) balancing reads
+
+    A map slice decodes every chunk it crosses, ``nt`` times the
+    size of the map for chunks ``nt`` steps long. A point series
+    decodes ``ntime / nt`` whole chunks. For a fixed chunk size
+    both read the same amount when ``nt`` squared is ``ntime``
+    times the chunk over the map size. Other leading axes get one
+    level per chunk and the remainder is split into square tiles
+
+    :param shape: variable shape, time first
+    :returns: tuple of chunk sizes
+    """
+    ntime, ny, nx = shape[0], shape[-2], shape[-1]
+    volume = max(chunk_bytes // itemsize, 1)
+    nt = int(np.clip(np.rint(np.sqrt(ntime * volume / (ny * nx))), 1, ntime))
+    side = max(int(np.sqrt(volume / nt)), 1)
+    return ((nt,) + (1,) * (len(shape) - 3) +
+            (min(side, ny), min(side, nx)))
@@ -0,0 +1,63 @@
+"""Summary statistics of images for colour mapper limits"""
+import numpy as np
+
+
+PERCENTILES = (0, 1, 2, 5, 95, 98, 99, 100)  # Offered auto ranges
+
+
+def summarise(images, percentiles=PERCENTILES):
+    """Min, max, NaN count and exact percentiles of images
+
+    :returns: dict or None if there are no finite values
+    """
+    values, nan_count = [], 0
+    for image in images:
+        image = np.asarray(image)
+        finite = np.isfinite(image)
+        missing = int(image.size - np.count_nonzero(finite))
+        if missing > 0:
+            image = image[finite]
+        if image.size > 0:
+            values.append(image.ravel())
+        nan_count += missing
+    if len(values) == 0:
+        return None
+    values = np.concatenate(values)
+    return {
+        "min": float(values.min()),
+        "max": float(values.max()),
+        "nan_count": nan_count,
+        "percentiles": dict(zip(
+            percentiles,
+            np.percentile(values, percentiles).astype(float)))
+    }
+
+
+def cached(cache, key, images):
+    """Summary kept alongside a cached image, computed if absent"""
+    if (cache is None) or (key is None):
+        return summarise(images)
+    return cache.derive(key, "summary", lambda: summarise(images))
+
+
+def percentile(summary, q):
+    """q-th percentile, interpolated between stored percentiles"""
+    if q <= 0:
+        return summary["min"]
+    if q >= 100:
+        return summary["max"]
+    stored = dict(summary["percentiles"])
+    stored.update({0: summary["min"], 100: summary["max"]})
+    if q in stored:
+        return stored[q]
+    qs = sorted(stored)
+    return float(np.interp(q, qs, [stored[k] for k in qs]))
+
+
+def limits(summaries, lower=0, upper=100):
+    """Range spanning percentiles of several summaries"""
+    summaries = [s for s in summaries if s is not None]
+    if len(summaries) == 0:
+        return None
+    return (min(percentile(s, lower) for s in summaries),
+            max(percentile(s, upper) for s in summaries))
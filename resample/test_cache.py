@@ -0,0 +1,101 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+import cache
+
+
+def entry(nbytes):
+    return {"image": [np.zeros(nbytes, dtype=np.uint8)]}
+
+
+class TestImageCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = cache.ImageCache(max_bytes=10)
+
+    def test_cost_is_image_nbytes(self):
+        self.cache["a"] = entry(4)
+        self.assertEqual(self.cache.nbytes, 4)
+
+    def test_evicts_least_recently_used(self):
+        self.cache["a"] = entry(4)
+        self.cache["b"] = entry(4)
+        self.cache["a"]
+        self.cache["c"] = entry(4)
+        self.assertEqual(self.cache.keys(), ["a", "c"])
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_pinned_entries_survive_eviction(self):
+        self.cache.pin("a")
+        self.cache["a"] = entry(4)
+        self.cache["b"] = entry(4)
+        self.cache["c"] = entry(4)
+        self.assertIn("a", self.cache)
+        self.assertNotIn("b", self.cache)
+
+    def test_get_counts_hits_and_misses(self):
+        self.cache["a"] = entry(1)
+        self.cache.get("a")
+        self.cache.get("b")
+        result = self.cache.stats()
+        self.assertEqual(result["hits"], 1)
+        self.assertEqual(result["misses"], 1)
+
+    def test_resize_evicts(self):
+        self.cache["a"] = entry(4)
+        self.cache["b"] = entry(4)
+        self.cache.resize(4)
+        self.assertEqual(self.cache.keys(), ["b"])
+
+    def test_no_budget_keeps_everything(self):
+        self.cache.resize(None)
+        for key in "abcdef":
+            self.cache[key] = entry(4)
+        self.assertEqual(len(self.cache), 6)
+
+    def test_derived_values_charged_and_evicted_with_entry(self):
+        self.cache["a"] = entry(4)
+        value = self.cache.derive("a", "half", lambda: entry(2))
+        self.assertIs(self.cache.derive("a", "half", lambda: entry(2)), value)
+        self.assertEqual(self.cache.nbytes, 6)
+        self.cache["b"] = entry(6)
+        self.assertNotIn("a", self.cache)
+        self.assertEqual(self.cache.nbytes, 6)
+
+    def test_derived_from_absent_key_not_kept(self):
+        self.cache.derive("a", "half", lambda: entry(2))
+        self.assertEqual(self.cache.nbytes, 0)
+
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "file.nc")
+        with open(self.path, "w") as stream:
+            stream.write("content")
+        self.cache = cache.DiskCache(os.path.join(self.directory, "cache"))
+        self.image = {
+            "x": [0.], "y": [1.], "dw": [2.], "dh": [3.],
+            "image": [np.arange(6, dtype="d").reshape(2, 3)]}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_get_missing_returns_none(self):
+        self.assertIsNone(self.cache.get(self.path, "v", 0, 0))
+
+    def test_put_then_get_memory_maps_float32(self):
+        self.cache.put(self.path, "v", 0, 0, self.image)
+        result = self.cache.get(self.path, "v", 0, 0)
+        self.assertEqual(result["dh"], [3.])
+        self.assertEqual(result["image"][0].dtype, np.float32)
+        self.assertIsInstance(result["image"][0], np.memmap)
+        np.testing.assert_array_equal(
+            result["image"][0], self.image["image"][0])
+
+    def test_modified_file_misses(self):
+        self.cache.put(self.path, "v", 0, 0, self.image)
+        with open(self.path, "a") as stream:
+            stream.write("more")
+        self.assertIsNone(self.cache.get(self.path, "v", 0, 0))
@@ -0,0 +1,516 @@
+import unittest
+import os
+import shutil
+import tempfile
+import json
+import datetime as dt
+import unittest.mock
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import netCDF4
+import scipy.ndimage
+import geo
+import summary
+import data
+
+
+class TestStretchY(unittest.TestCase):
+    def setUp(self):
+        self.y = np.array([0., 1., 3., 6., 10.])
+        self.values = np.arange(20, dtype="d").reshape(5, 4)
+
+    def map_coordinates(self, values, axis):
+        index = np.arange(len(self.y), dtype="d")
+        even = np.linspace(self.y.min(), self.y.max(), len(self.y))
+        fractions = np.interp(even, self.y, index)
+        i = np.arange(values.shape[0], dtype="d")
+        j = np.arange(values.shape[1], dtype="d")
+        if axis == 0:
+            i = fractions
+        else:
+            j = fractions
+        return scipy.ndimage.map_coordinates(
+            values, np.meshgrid(i, j, indexing="ij"), order=1)
+
+    def test_stretch_matches_map_coordinates(self):
+        result = data.stretch_y(self.y)(self.values)
+        expect = self.map_coordinates(self.values, 0)
+        np.testing.assert_array_almost_equal(expect, result)
+
+    def test_stretch_along_axis_1(self):
+        values = self.values.T
+        result = data.stretch_y(self.y)(values, axis=1)
+        expect = self.map_coordinates(values, 1)
+        np.testing.assert_array_almost_equal(expect, result)
+
+    def test_stretch_preserves_float32(self):
+        values = self.values.astype(np.float32)
+        result = data.stretch_y(self.y)(values)
+        self.assertEqual(result.dtype, np.float32)
+
+    def test_stretch_cached_per_axis(self):
+        self.assertIs(
+            data.stretch_y(self.y),
+            data.stretch_y(list(self.y)))
+
+    def test_stretch_stack_matches_slices(self):
+        stack = np.stack([self.values, 2 * self.values])
+        result = data.stretch_y(self.y)(stack)
+        for i in range(len(stack)):
+            expect = data.stretch_y(self.y)(stack[i])
+            np.testing.assert_array_almost_equal(expect, result[i])
+
+    def test_stretch_stack_with_executor(self):
+        stack = np.stack([self.values, 2 * self.values])
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            result = data.stretch_y(self.y)(stack, executor=executor)
+        expect = data.stretch_y(self.y)(stack)
+        np.testing.assert_array_almost_equal(expect, result)
+
+
+class TestLoadImageAsync(unittest.TestCase):
+    def setUp(self):
+        self.event = threading.Event()
+        self.calls = []
+
+        def read_images(path, variable, keys, executor=None):
+            self.calls.append(keys)
+            self.event.wait(0.5)
+            return {key: {"image": [np.zeros(1)]} for key in keys}
+
+        patcher = unittest.mock.patch("data.read_images", read_images)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        for key in data.IMAGES.keys():
+            if key[0] == "file.nc":
+                del data.IMAGES[key]
+
+    def test_concurrent_requests_share_one_future(self):
+        futures = [data.load_image_async("file.nc", "v", 0, 0)
+                   for _ in range(10)]
+        self.event.set()
+        results = [f.result(1) for f in futures]
+        self.assertEqual(len(self.calls), 1)
+        self.assertTrue(all(r is results[0] for r in results))
+
+    def test_load_image_waits_for_in_flight_future(self):
+        future = data.load_image_async("file.nc", "v", 0, 1)
+        result = data.load_image("file.nc", "v", 0, 1)
+        self.assertIs(result, future.result(1))
+        self.assertEqual(len(self.calls), 1)
+
+    def test_load_images_async_reads_keys_together(self):
+        futures = data.load_images_async("file.nc", "v", [(2, 0), (2, 1)])
+        self.event.set()
+        [f.result(1) for f in futures]
+        self.assertEqual(self.calls, [[("file.nc", "v", 0, 2),
+                                       ("file.nc", "v", 1, 2)]])
+
+
+class TestLoadImage(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "file.nc")
+        with netCDF4.Dataset(self.path, "w") as dataset:
+            for name, size in [("time", 1), ("latitude", 3), ("longitude", 4)]:
+                dataset.createDimension(name, size)
+                dataset.createVariable(name, "f", (name,))[:] = np.arange(size)
+            var = dataset.createVariable(
+                "stratiform_rainfall_rate", "f",
+                ("time", "latitude", "longitude"))
+            var[:] = np.ma.masked_all((1, 3, 4))
+
+    def tearDown(self):
+        for key in data.IMAGES.keys():
+            if key[0] == self.path:
+                del data.IMAGES[key]
+        data.DATASETS.close()
+        shutil.rmtree(self.directory)
+
+    def test_all_masked_field_loads(self):
+        result = data.load_image(self.path, "stratiform_rainfall_rate", 0, 0)
+        self.assertTrue(np.isnan(result["image"][0]).all())
+        key = (self.path, "stratiform_rainfall_rate", 0, 0)
+        self.assertIsNone(summary.cached(data.IMAGES, key, None))
+
+
+class TestFileDB(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.pattern = os.path.join(self.directory, "*.nc")
+        self.file_db = data.FileDB({"UM": self.pattern})
+        self.changes = []
+        self.file_db.subscribe(
+            lambda *args: self.changes.append(args))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def touch(self, name, mtime):
+        path = os.path.join(self.directory, name)
+        open(path, "w").close()
+        os.utime(self.directory, ns=(mtime, mtime))
+        return path
+
+    def test_sync_records_entries(self):
+        path = self.touch("um_20190417T0000Z.nc", 1)
+        self.touch("ignored.txt", 2)
+        self.file_db.sync()
+        self.assertEqual(self.file_db.files, {"UM": [path]})
+        entry = self.file_db.entries["UM"][path]
+        self.assertEqual(entry.size, 0)
+        self.assertEqual(entry.initial_time, dt.datetime(2019, 4, 17))
+
+    def test_sync_announces_added_and_removed(self):
+        first = self.touch("a.nc", 1)
+        self.file_db.sync()
+        second = self.touch("b.nc", 2)
+        os.remove(first)
+        os.utime(self.directory, ns=(3, 3))
+        self.file_db.sync()
+        self.assertEqual(self.changes, [
+            ("UM", [first], []),
+            ("UM", [second], [first])])
+
+    def test_sync_announces_files_changed_in_place(self):
+        path = self.touch("a.nc", 1)
+        self.file_db.sync()
+        with open(path, "w") as stream:
+            stream.write("more")
+        os.utime(self.directory, ns=(1, 1))
+        self.file_db.sync()
+        self.assertEqual(self.changes[-1], ("UM", [path], [path]))
+        self.assertEqual(self.file_db.entries["UM"][path].size, 4)
+
+    def test_unchanged_directory_not_listed(self):
+        self.touch("a.nc", 1)
+        self.file_db.sync()
+        with unittest.mock.patch("os.scandir") as scandir:
+            self.file_db.sync()
+        scandir.assert_not_called()
+
+
+class TestSeriesHelpers(unittest.TestCase):
+    def test_nearest_index_unsorted_axis(self):
+        values = np.array([180., 350., 10.])
+        order = np.argsort(values)
+        result = data.nearest_index(values[order], order, [12., 300., 200.])
+        np.testing.assert_array_equal(result, [2, 1, 0])
+
+    def test_summed_area_box_sum(self):
+        values = np.arange(12, dtype="d").reshape(3, 4)
+        table = data.summed_area(values)
+        result = table[3, 3] - table[1, 3] - table[3, 1] + table[1, 1]
+        self.assertEqual(result, values[1:3, 1:3].sum())
+
+
+class TestGPM(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.paths = [self.write("a.nc", [0, 30, 60]),
+                      self.write("b.nc", [90, 120])]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, minutes):
+        path = os.path.join(self.directory, name)
+        with netCDF4.Dataset(path, "w") as dataset:
+            dataset.createDimension("time", len(minutes))
+            var = dataset.createVariable("time", "d", ("time",))
+            var.units = "minutes since 2019-04-17 00:00:00"
+            var[:] = minutes
+        return path
+
+    def test_locate_spans_files(self):
+        loader = data.GPM(self.paths)
+        self.assertEqual(loader.locate(2), (self.paths[0], 2))
+        self.assertEqual(loader.locate(3), (self.paths[1], 0))
+        self.assertEqual(loader.times[4].hour, 2)
+        with self.assertRaises(IndexError):
+            loader.locate(5)
+
+    def test_find_record_covering_time(self):
+        loader = data.GPM(self.paths)
+        self.assertEqual(loader.find(dt.datetime(2019, 4, 17, 0, 45)), 1)
+        self.assertEqual(loader.find(dt.datetime(2019, 4, 17, 1)), 2)
+        self.assertEqual(loader.find(dt.datetime(2019, 4, 17, 2, 29)), 4)
+
+    def test_find_outside_records(self):
+        loader = data.GPM(self.paths)
+        self.assertIsNone(loader.find(None))
+        self.assertIsNone(loader.find(dt.datetime(2019, 4, 16, 23, 59)))
+        self.assertIsNone(loader.find(dt.datetime(2019, 4, 17, 2, 30)))
+
+    def test_find_accepts_model_times(self):
+        loader = data.GPM(self.paths)
+        valid = netCDF4.num2date(90, units="minutes since 2019-04-17 00:00")
+        self.assertEqual(loader.find(valid), 3)
+
+    def test_on_files_rebuilds_index(self):
+        loader = data.GPM(self.paths[:1])
+        loader.on_files(self.paths[1:], self.paths[:1])
+        self.assertEqual(len(loader.times), 2)
+        self.assertEqual(loader.locate(1), (self.paths[1], 1))
+
+
+class TestRDT(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.paths = [self.write("RDT_{}.json".format(stamp))
+                      for stamp in ["201904171015", "201904170945",
+                                    "201904171000"]]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, phase=1):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as stream:
+            json.dump({"features": [{
+                "geometry": {"coordinates": [[[0, 0], [10, 0], [10, 10]]]},
+                "properties": {"PhaseLife": phase}}]}, stream)
+        return path
+
+    def test_load_projects_rings(self):
+        result = json.loads(data.RDT.load(self.paths[0]))
+        feature = result["features"][0]
+        x, y = geo.web_mercator([0, 10, 10], [0, 0, 10])
+        np.testing.assert_array_almost_equal(
+            feature["geometry"]["coordinates"][0],
+            np.column_stack([x, y]))
+        self.assertEqual(feature["properties"]["PhaseLife"], "1")
+
+    def test_load_without_features(self):
+        path = os.path.join(self.directory, "empty.json")
+        with open(path, "w") as stream:
+            json.dump({"features": []}, stream)
+        self.assertEqual(json.loads(data.RDT.load(path)), {"features": []})
+
+    def test_find_latest_at_or_before(self):
+        loader = data.RDT(self.paths)
+        self.assertEqual(loader.find(None), self.paths[1])
+        self.assertEqual(
+            loader.find(dt.datetime(2019, 4, 17, 10, 5)), self.paths[2])
+        self.assertEqual(
+            loader.find(dt.datetime(2019, 4, 17, 10, 15, 30)), self.paths[0])
+        self.assertEqual(
+            loader.find(dt.datetime(2019, 4, 17, 9)), self.paths[1])
+
+    def test_find_does_not_parse_names(self):
+        loader = data.RDT(self.paths)
+        with unittest.mock.patch("data.rdt_time") as rdt_time:
+            loader.find(dt.datetime(2019, 4, 17, 10))
+        rdt_time.assert_not_called()
+
+    def test_on_files_updates_index(self):
+        loader = data.RDT(self.paths[:1])
+        loader.on_files(self.paths[1:], self.paths[:1])
+        self.assertEqual(loader.paths, [self.paths[1], self.paths[2]])
+        self.assertEqual(
+            loader.find(dt.datetime(2019, 4, 17, 11)), self.paths[2])
+
+    def test_geojson_cached_per_path(self):
+        loader = data.RDT(self.paths)
+        with unittest.mock.patch.object(
+                data.RDT, "load", wraps=data.RDT.load) as load:
+            first = loader.geojson(dt.datetime(2019, 4, 17, 10))
+            second = loader.geojson(dt.datetime(2019, 4, 17, 10, 5))
+            loader.geojson(None)
+        self.assertIs(first, second)
+        self.assertEqual(load.call_count, 2)
+
+    def test_geojson_reloads_modified_file(self):
+        loader = data.RDT(self.paths)
+        valid = dt.datetime(2019, 4, 17, 10)
+        loader.geojson(valid)
+        self.write(os.path.basename(self.paths[2]), phase=2)
+        os.utime(self.paths[2], ns=(0, 0))
+        result = json.loads(loader.geojson(valid))
+        self.assertEqual(
+            result["features"][0]["properties"]["PhaseLife"], "2")
+
+    def test_removed_files_leave_cache(self):
+        loader = data.RDT(self.paths)
+        loader.geojson(None)
+        loader.on_files([], self.paths[1:2])
+        self.assertEqual(loader.geojsons, {})
+
+
+class TestUMLoaderColumns(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "um_20190417T0000Z.nc")
+        with netCDF4.Dataset(self.path, "w") as dataset:
+            for name, size in [("time", 2), ("pressure", 3),
+                               ("latitude", 4), ("longitude", 5)]:
+                dataset.createDimension(name, size)
+            var = dataset.createVariable("time", "d", ("time",))
+            var.units = "hours since 2019-04-17 00:00:00"
+            var[:] = [0, 3]
+            dataset.createVariable("pressure", "d", ("pressure",))[:] = [
+                1000, 850, 500]
+            dataset.createVariable("latitude", "f", ("latitude",))[:] = [
+                -1, 0, 1, 2]
+            dataset.createVariable("longitude", "f", ("longitude",))[:] = [
+                0, 1, 2, 3, 4]
+            dataset.createVariable(
+                "relative_humidity", "f",
+                ("time", "pressure", "latitude", "longitude"))[:] = np.arange(
+                    2 * 3 * 4 * 5).reshape(2, 3, 4, 5)
+            dataset.createVariable(
+                "air_temperature", "f",
+                ("time", "latitude", "longitude"))[:] = np.zeros((2, 4, 5))
+        self.loader = data.UMLoader([self.path])
+
+    def tearDown(self):
+        for key in data.IMAGES.keys():
+            if key[0] == self.path:
+                del data.IMAGES[key]
+        data.DATASETS.close()
+        shutil.rmtree(self.directory)
+
+    def test_column_spans_pressure_levels(self):
+        self.assertEqual(
+            self.loader.column("relative_humidity", 1, 0),
+            [(0, 0), (0, 1), (0, 2)])
+        self.assertEqual(
+            self.loader.column("air_temperature", 0, 1), [(1, 0)])
+
+    def test_image_caches_every_level(self):
+        result = self.loader.image("relative_humidity", 1, 1)
+        self.assertEqual(result["level"], ["850 hPa"])
+        for j in range(3):
+            self.assertIn((self.path, "relative_humidity", j, 1), data.IMAGES)
+        with unittest.mock.patch("data.read_images") as read_images:
+            self.loader.image("relative_humidity", 2, 1)
+        read_images.assert_not_called()
+
+
+class TestUMLoaderFiles(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.paths = [self.write("20190417T0000Z", [0, 3]),
+                      self.write("20190417T1200Z", [12, 15, 18])]
+        self.loader = data.UMLoader(self.paths)
+
+    def tearDown(self):
+        data.DATASETS.close()
+        shutil.rmtree(self.directory)
+
+    def write(self, stamp, hours, variable="air_temperature"):
+        path = os.path.join(self.directory, "um_{}.nc".format(stamp))
+        with netCDF4.Dataset(path, "w") as dataset:
+            for name, size in [("time", len(hours)), ("pressure", 1),
+                               ("latitude", 2), ("longitude", 2)]:
+                dataset.createDimension(name, size)
+            var = dataset.createVariable("time", "d", ("time",))
+            var.units = "hours since 2019-04-17 00:00:00"
+            var[:] = hours
+            dataset.createVariable("pressure", "d", ("pressure",))[:] = [
+                1000]
+            dataset.createVariable("latitude", "f", ("latitude",))[:] = [
+                0, 1]
+            dataset.createVariable("longitude", "f", ("longitude",))[:] = [
+                0, 1]
+            dataset.createVariable(
+                variable, "f", ("time", "latitude", "longitude"))[:] = \
+                np.zeros((len(hours), 2, 2))
+        return path
+
+    def test_removing_first_file_reloads_metadata(self):
+        self.loader.sorted_axis("longitude", "air_temperature")
+        self.loader.on_files([], self.paths[:1])
+        _, metadata = self.loader.metadata("air_temperature", 0, 1)
+        self.assertEqual(metadata["initial"], [dt.datetime(2019, 4, 17, 12)])
+        self.assertEqual(metadata["valid"], [dt.datetime(2019, 4, 17, 15)])
+        self.assertEqual(metadata["length"], ["T+3"])
+        self.assertEqual(len(self.loader.series_times("air_temperature")), 3)
+        self.assertEqual(self.loader._axes, {})
+        self.assertEqual(
+            self.loader.key("air_temperature", 0, 1)[0], self.paths[1])
+
+    def test_later_files_keep_metadata(self):
+        with unittest.mock.patch.object(
+                self.loader, "load_metadata") as load_metadata:
+            self.loader.on_files(
+                [self.write("20190418T0000Z", [24])], self.paths[1:])
+        load_metadata.assert_not_called()
+
+    def test_rewritten_first_file_reloads_metadata(self):
+        data.DATASETS.close()
+        self.write("20190417T0000Z", [0, 3], variable="relative_humidity")
+        self.loader.on_files(self.paths[:1], self.paths[:1])
+        self.assertEqual(self.loader.variables, ["relative_humidity"])
+
+    def test_removing_every_file(self):
+        self.loader.on_files([], self.paths)
+        self.assertEqual(self.loader.paths, [])
+        self.assertEqual(self.loader.variables, [])
+        with self.assertRaises(KeyError):
+            self.loader.key("air_temperature", 0, 0)
+        self.loader.on_files(self.paths, [])
+        self.assertEqual(self.loader.variables, ["air_temperature"])
+
+
+class TestUMLoaderSeries(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "um_20190417T0000Z.nc")
+        random = np.random.RandomState(0)
+        self.lons = np.array([3, 0, 4, 1, 2, 5], dtype="f")  # Unsorted
+        self.lats = np.array([-2, -1, 0, 1, 2], dtype="f")
+        self.values = random.rand(3, 2, 5, 6).astype("f")
+        self.values[1, :, 2, 2] = np.nan
+        with netCDF4.Dataset(self.path, "w") as dataset:
+            for name, size in [("time", 3), ("pressure", 2),
+                               ("latitude", 5), ("longitude", 6)]:
+                dataset.createDimension(name, size)
+            var = dataset.createVariable("time", "d", ("time",))
+            var.units = "hours since 2019-04-17 00:00:00"
+            var[:] = [0, 3, 6]
+            dataset.createVariable("pressure", "d", ("pressure",))[:] = [
+                1000, 850]
+            dataset.createVariable("latitude", "f", ("latitude",))[:] = self.lats
+            dataset.createVariable("longitude", "f", ("longitude",))[:] = self.lons
+            dataset.createVariable(
+                "relative_humidity", "f",
+                ("time", "pressure", "latitude", "longitude"))[:] = np.ma.masked_invalid(
+                    self.values)
+        self.loader = data.UMLoader([self.path])
+
+    def tearDown(self):
+        data.DATASETS.close()
+        shutil.rmtree(self.directory)
+
+    def test_series_points_match_nearest_grid_points(self):
+        lons, lats = np.array([0.2, 3.6, 4.9]), np.array([1.8, -0.4, -2.])
+        xs, ys = geo.web_mercator(lons, lats)
+        result = self.loader.series_points("relative_humidity", xs, ys, 1)
+        for n, (lon, lat) in enumerate(zip(lons, lats)):
+            i = np.argmin(np.abs(self.lons - lon))
+            j = np.argmin(np.abs(self.lats - lat))
+            np.testing.assert_allclose(result["y"][n], self.values[:, 1, j, i])
+        self.assertEqual(len(result["x"]), 3)
+
+    def test_series_is_a_single_point(self):
+        x, y = geo.web_mercator([2.], [0.])
+        result = self.loader.series("relative_humidity", x[0], y[0], 0)
+        np.testing.assert_allclose(result["y"], self.values[:, 0, 2, 4])
+
+    def test_series_boxes_match_brute_force_means(self):
+        boxes = [(0.5, -1.5, 3.5, 1.5), (1.5, -2, 5, 2)]
+        corners = [geo.web_mercator([x0, x1], [y0, y1])
+                   for x0, y0, x1, y1 in boxes]
+        result = self.loader.series_boxes(
+            "relative_humidity",
+            [(x[0], y[0], x[1], y[1]) for x, y in corners], 0)
+        for n, (lon0, lat0, lon1, lat1) in enumerate(boxes):
+            i = (self.lons >= lon0) & (self.lons <= lon1)
+            j = (self.lats >= lat0) & (self.lats <= lat1)
+            expect = np.nanmean(
+                self.values[:, 0][:, j][:, :, i].reshape(3, -1), axis=1)
+            np.testing.assert_allclose(result["y"][n], expect, rtol=1e-5)
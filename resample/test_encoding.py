@@ -0,0 +1,48 @@
+import unittest
+import numpy as np
+import encoding
+
+
+class TestEncoding(unittest.TestCase):
+    def setUp(self):
+        self.data = {
+            "x": [0.],
+            "image": [np.array([[np.nan, 0.], [5., 10.]])]
+        }
+
+    def test_float32_downcast(self):
+        result = encoding.encode(self.data)
+        self.assertEqual(result["image"][0].dtype, np.float32)
+        self.assertEqual(result["encoding"], ["float32"])
+        self.assertEqual(result["x"], [0.])
+
+    def test_uint8_round_trip(self):
+        result = encoding.encode(self.data, "uint8", 0., 10.)
+        self.assertEqual(result["image"][0].dtype, np.uint8)
+        np.testing.assert_array_equal(result["image"][0], [[255, 0], [127, 254]])
+        np.testing.assert_allclose(
+            encoding.decode(result), self.data["image"][0], atol=10. / 254)
+
+    def test_values_outside_limits_clipped(self):
+        result = encoding.encode(self.data, "uint16", 2., 6.)
+        np.testing.assert_allclose(
+            encoding.decode(result), [[np.nan, 2.], [5., 6.]], atol=1e-4)
+
+    def test_rgba_bins_like_linear_color_mapper(self):
+        lut = encoding.lut(["#000000", "#ff0000"], nan_color=0)
+        result = encoding.encode(self.data, "rgba", 0., 10., lut)
+        image = result["image"][0]
+        self.assertEqual(image.dtype, np.uint32)
+        rgba = image.view(np.uint8).reshape(2, 2, 4)
+        np.testing.assert_array_equal(rgba[..., 0], [[0, 0], [255, 255]])
+        np.testing.assert_array_equal(rgba[..., 3], [[0, 255], [255, 255]])
+
+    def test_lut_shared_by_palette(self):
+        palette = ["#000000", "#ffffff"]
+        self.assertIs(encoding.lut(palette), encoding.lut(list(palette)))
+
+    def test_cropped_images_made_contiguous(self):
+        data = {"image": [np.zeros((4, 4))[1:3, 1:3]]}
+        for mode in ["float32", "uint8"]:
+            image = encoding.encode(data, mode, 0., 1.)["image"][0]
+            self.assertTrue(image.flags["C_CONTIGUOUS"])
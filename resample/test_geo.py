@@ -0,0 +1,64 @@
+import unittest
+import numpy as np
+import cartopy
+import geo
+
+
+class TestWebMercator(unittest.TestCase):
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.lons = random.uniform(-540., 540., 1000)
+        self.lats = random.uniform(-89., 89., 1000)
+
+    def cartopy_web_mercator(self, lons, lats):
+        return geo.transform(
+            lons,
+            lats,
+            cartopy.crs.PlateCarree(),
+            cartopy.crs.Mercator.GOOGLE)
+
+    def test_web_mercator_float64(self):
+        x, y = geo.web_mercator(self.lons, self.lats)
+        ex, ey = self.cartopy_web_mercator(self.lons, self.lats)
+        np.testing.assert_allclose(x, ex, rtol=0, atol=1e-5)
+        np.testing.assert_allclose(y, ey, rtol=0, atol=1e-5)
+
+    def test_web_mercator_float32(self):
+        lons = self.lons.astype(np.float32)
+        lats = self.lats.astype(np.float32)
+        x, y = geo.web_mercator(lons, lats)
+        ex, ey = self.cartopy_web_mercator(lons, lats)
+        self.assertEqual(x.dtype, np.float32)
+        np.testing.assert_allclose(x, ex, rtol=1e-6, atol=geo.WORLD_WIDTH * 1e-7)
+        np.testing.assert_allclose(y, ey, rtol=1e-6, atol=geo.WORLD_WIDTH * 1e-7)
+
+    def test_web_mercator_wraps_longitudes(self):
+        lons = [180., -180., 190., -190., 360., 540.]
+        x, _ = geo.web_mercator(lons, np.zeros(len(lons)))
+        ex, _ = self.cartopy_web_mercator(lons, np.zeros(len(lons)))
+        np.testing.assert_allclose(x, ex, atol=1e-5)
+
+    def test_web_mercator_out(self):
+        out = np.empty(1000), np.empty(1000)
+        x, y = geo.web_mercator(self.lons, self.lats, out=out)
+        self.assertIs(x, out[0])
+        self.assertIs(y, out[1])
+
+    def test_plate_carree_inverts_web_mercator(self):
+        x, y = geo.web_mercator(self.lons, self.lats)
+        lons, lats = geo.plate_carree(x, y)
+        np.testing.assert_allclose(lons, geo.to_180(self.lons % 360.),
+                                   atol=1e-9)
+        np.testing.assert_allclose(lats, self.lats, atol=1e-9)
+
+    def test_plate_carree_matches_cartopy(self):
+        x = np.linspace(-1.5, 1.5, 101) * geo.WORLD_WIDTH
+        y = np.linspace(-3e7, 3e7, 101)
+        lons, lats = geo.plate_carree(x, y)
+        elons, elats = geo.transform(
+            x,
+            y,
+            cartopy.crs.Mercator.GOOGLE,
+            cartopy.crs.PlateCarree())
+        np.testing.assert_allclose(lons, elons, atol=1e-9)
+        np.testing.assert_allclose(lats, elats, atol=1e-9)
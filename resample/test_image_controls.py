@@ -41,3 +41,15 @@ class TestControls(unittest.TestCase):
             "A": [True, False, True]
         }
         self.assertEqual(expect, result)
+
+    def test_render_announces_changes_only(self):
+        announced = []
+        self.controls.subscribe(announced.append)
+        self.controls.on_dropdown(0)(None, None, "A")
+        self.controls.on_radio(0)(None, [], [0])
+        self.controls.on_radio(0)(None, [0], [0, 1])
+        self.controls.render()
+        self.assertEqual(announced, [
+            {},
+            {"A": [True, False, False]},
+            {"A": [True, True, False]}])
@@ -0,0 +1,81 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+import lightning
+
+
+CSV = """0,2019-04-17T12:00:00.000,1.5,30.5,0,0
+1,2019-04-17T11:00:00.000,-2.5,10.5,0,0
+9,2019-04-17T13:00:00.000,1.7,30.7,0,0
+x,2019-04-17T14:00:00.000,45.0,-60.0,0,0
+"""
+
+
+class TestLightning(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "englnrt_20190417")
+        with open(self.path, "w") as stream:
+            stream.write(CSV)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_parse_codes_flash_types(self):
+        result = lightning.parse(self.path)["flash_type"]
+        np.testing.assert_array_equal(result, [0, 1, 2, -1])
+
+    def test_parse_times_as_int64(self):
+        result = lightning.parse(self.path)["time"]
+        expect = np.datetime64("2019-04-17T12:00", "ns").astype("int64")
+        self.assertEqual(result.dtype, np.int64)
+        self.assertEqual(result[0], expect)
+
+    def test_load_writes_and_reuses_cache(self):
+        directory = os.path.join(self.directory, "cache")
+        lightning.load(self.path, directory)
+        self.assertEqual(len(os.listdir(directory)), 1)
+        result = lightning.load(self.path, directory)
+        np.testing.assert_array_equal(
+            result["flash_type"], [0, 1, 2, -1])
+
+    def test_query_time_window_sorted(self):
+        flashes = lightning.Flashes.concat([lightning.parse(self.path)])
+        result = flashes.query(
+            start=np.datetime64("2019-04-17T11:30"),
+            end=np.datetime64("2019-04-17T14:00"))
+        np.testing.assert_array_equal(result["flash_type"], ["CG", "Keep alive"])
+
+    def test_query_bbox(self):
+        flashes = lightning.Flashes.concat([lightning.parse(self.path)])
+        result = flashes.query(bbox=(30, 1, 31, 2))
+        np.testing.assert_array_almost_equal(result["longitude"], [30.5, 30.7])
+
+    def test_query_bbox_uses_grid_when_narrower(self):
+        columns = lightning.parse(self.path)
+        many = {k: np.concatenate([v] * 50) for k, v in columns.items()}
+        flashes = lightning.Flashes.concat([many])
+        result = flashes.query(bbox=(-61, 44, -59, 46))
+        self.assertEqual(len(result["date"]), 50)
+        self.assertTrue(all(result["flash_type"] == "Unknown"))
+
+
+    def test_count_matches_query(self):
+        flashes = lightning.Flashes.concat([lightning.parse(self.path)])
+        for bbox in [None, (30, 1, 31, 2), (-180, -90, 180, 90)]:
+            self.assertEqual(
+                flashes.count(bbox=bbox),
+                len(flashes.query(bbox=bbox)["date"]))
+        self.assertEqual(flashes.count(bbox=(-180, -90, 180, 90)), len(flashes))
+
+
+class TestAggregate(unittest.TestCase):
+    def test_aggregate_counts_cells(self):
+        x = [0.1, 0.2, 1.5, -0.5]
+        y = [0.1, 0.9, 0.5, -0.5]
+        cx, cy, counts = lightning.aggregate(x, y, 1.)
+        result = sorted(zip(cx, cy, counts))
+        expect = [(-0.5, -0.5, 1), (0.5, 0.5, 2), (1.5, 0.5, 1)]
+        self.assertEqual(expect, result)
@@ -0,0 +1,49 @@
+import unittest
+import numpy as np
+import shapely.geometry
+import data
+import lines
+
+
+class TestLines(unittest.TestCase):
+    def setUp(self):
+        x = np.linspace(0., 1e6, 1001)
+        y = 10. * np.sin(x)  # Wiggles far smaller than a pixel
+        self.lines = lines.Lines([(x, y), (x + 5e6, y)], max_level=4)
+
+    def test_levels_simplify_with_zoom(self):
+        counts = [len(level.x) for level in self.lines.levels]
+        self.assertEqual(counts[0], 4)
+        self.assertEqual(counts[-1], 2002)
+        self.assertEqual(counts, sorted(counts))
+
+    def test_level_tolerance_below_pixel(self):
+        pixel = lines.pixel_size(2) * 1.5
+        level = self.lines.level(pixel)
+        self.assertIs(level, self.lines.levels[2])
+        self.assertIs(self.lines.level(0.1), self.lines.levels[-1])
+
+    def test_query_float32_viewport_subset(self):
+        result = self.lines.query(0.1, bbox=(4e6, -1., 7e6, 1.))
+        self.assertEqual(len(result["xs"]), 1)
+        self.assertEqual(result["xs"][0].dtype, np.float32)
+        self.assertEqual(result["xs"][0][0], 5e6)
+
+    def test_small_lines_dropped(self):
+        small = lines.Lines([(np.array([0., 1.]), np.array([0., 1.]))],
+                            max_level=0)
+        self.assertEqual(len(small.levels[0].bounds), 0)
+        self.assertEqual(len(small.levels[-1].bounds), 1)
+
+
+class TestFeatureLines(unittest.TestCase):
+    def test_multi_and_single_line_strings(self):
+        class Feature(object):
+            def geometries(self):
+                yield shapely.geometry.MultiLineString([
+                    [(0, 0), (10, 10)], [(20, 0), (30, 10)]])
+                yield shapely.geometry.LineString([(0, 0), (0, 10)])
+        result = data.feature_lines(Feature())
+        self.assertEqual(len(result.levels[-1].bounds), 3)
+        np.testing.assert_allclose(
+            result.levels[-1].x[-2:], [0., 0.], atol=1e-6)
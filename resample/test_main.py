@@ -0,0 +1,258 @@
+import unittest
+import unittest.mock
+from concurrent.futures import Future
+import numpy as np
+import bokeh.models
+import bokeh.plotting
+import data
+import view
+import main
+
+
+class TestSeries(unittest.TestCase):
+    def setUp(self):
+        self.futures = {"a": [], "b": []}
+        loaders = {}
+        for name in self.futures:
+            loader = unittest.mock.Mock(spec=data.UMLoader)
+            loader.series_async.side_effect = self.series_async(name)
+            loaders[name] = loader
+        patcher = unittest.mock.patch.dict(data.LOADERS, loaders, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.document = unittest.mock.Mock()
+        self.callbacks = []
+        self.document.add_next_tick_callback.side_effect = \
+            self.callbacks.append
+        patcher = unittest.mock.patch(
+                "bokeh.plotting.curdoc", return_value=self.document)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.series = main.Series(bokeh.plotting.figure(), deadline=100)
+        self.series.on_field("air_temperature", 0, 0)
+
+    def series_async(self, name):
+        def method(variable, x, y, ipressure):
+            future = Future()
+            self.futures[name].append(future)
+            return future
+        return method
+
+    def tap(self, x=1., y=2.):
+        self.series.on_tap(unittest.mock.Mock(x=x, y=y))
+
+    def tick(self):
+        while self.callbacks:
+            self.callbacks.pop(0)()
+
+    def test_render_reads_every_model(self):
+        self.tap()
+        for name in self.futures:
+            data.LOADERS[name].series_async.assert_called_once_with(
+                    "air_temperature", 1., 2., 0)
+        self.document.add_timeout_callback.assert_called_once_with(
+                self.series.on_deadline, 100)
+
+    def test_results_update_sources(self):
+        self.tap()
+        self.futures["a"][0].set_result({"x": [1], "y": [2]})
+        self.tick()
+        self.assertEqual(self.series.sources["a"].data, {"x": [1], "y": [2]})
+        self.assertEqual(list(self.series.futures), ["b"])
+        self.document.remove_timeout_callback.assert_not_called()
+
+    def test_last_result_removes_deadline(self):
+        self.tap()
+        self.futures["a"][0].set_result({"x": [1], "y": [2]})
+        self.tick()
+        self.futures["b"][0].set_exception(KeyError("b"))
+        self.tick()
+        self.assertEqual(self.series.futures, {})
+        self.assertIsNone(self.series.timeout)
+        self.document.remove_timeout_callback.assert_called_once_with(
+                self.document.add_timeout_callback.return_value)
+
+    def test_new_tap_cancels_previous_reads(self):
+        self.tap()
+        self.tap(3., 4.)
+        self.tick()
+        for name in self.futures:
+            first, second = self.futures[name]
+            self.assertTrue(first.cancelled())
+            self.assertIs(self.series.futures[name], second)
+        self.assertEqual(self.document.remove_timeout_callback.call_count, 1)
+
+    def test_superseded_result_ignored(self):
+        self.tap()
+        first = self.futures["a"][0]
+        first.set_running_or_notify_cancel()  # Already started reading
+        self.tap(3., 4.)
+        first.set_result({"x": [1], "y": [2]})
+        self.tick()
+        self.assertEqual(self.series.sources["a"].data, {"x": [], "y": []})
+        self.assertIs(self.series.futures["a"], self.futures["a"][1])
+
+    def test_deadline_clears_late_models(self):
+        self.series.sources["b"].data = {"x": [0], "y": [0]}
+        self.tap()
+        late = self.futures["b"][0]
+        late.set_running_or_notify_cancel()
+        self.futures["a"][0].set_result({"x": [1], "y": [2]})
+        self.tick()
+        self.series.on_deadline()
+        self.assertEqual(self.series.sources["b"].data, {"x": [], "y": []})
+        self.assertEqual(self.series.futures, {})
+        self.document.remove_timeout_callback.assert_not_called()
+        late.set_result({"x": [5], "y": [6]})
+        self.tick()
+        self.assertEqual(self.series.sources["b"].data, {"x": [], "y": []})
+        self.assertEqual(self.series.sources["a"].data, {"x": [1], "y": [2]})
+
+    def test_no_reads_until_tapped(self):
+        for loader in data.LOADERS.values():
+            loader.series_async.assert_not_called()
+        self.document.add_timeout_callback.assert_not_called()
+
+
+class TestArtist(unittest.TestCase):
+    def setUp(self):
+        patcher = unittest.mock.patch.dict(data.LOADERS, {}, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.document = unittest.mock.Mock()
+        self.callbacks = []
+        self.document.add_next_tick_callback.side_effect = \
+            self.callbacks.append
+        patcher = unittest.mock.patch(
+                "bokeh.plotting.curdoc", return_value=self.document)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        color_mapper = bokeh.models.LinearColorMapper(
+                palette="Viridis256", low=0, high=1)
+        self.artist = main.Artist([], color_mapper)
+        self.futures = []
+        for name in ["a", "b"]:
+            viewer = unittest.mock.Mock(spec=view.UMView)
+            viewer.encoder = view.Encoder(
+                    bokeh.models.ColumnDataSource(), color_mapper)
+            viewer.render.side_effect = self.render(viewer.encoder)
+            self.artist.viewers[name] = viewer
+            self.artist.renderers[name] = [unittest.mock.Mock()]
+        self.limits = main.MapperLimits(
+                [v.encoder for v in self.artist.viewers.values()],
+                color_mapper)
+
+    def render(self, encoder):
+        def method(variable, ipressure, itime):
+            if variable is None:
+                return None
+            low, high = self.fields[variable]
+            encoder.set({
+                "x": [0], "y": [0], "dw": [1], "dh": [1],
+                "image": [np.linspace(low, high, 4).reshape(2, 2)]})
+            future = Future()
+            self.futures.append(future)
+            return future
+        return method
+
+    fields = {
+        "relative_humidity": (0.15, 100.),
+        "air_temperature": (250., 274.)
+    }
+
+    def tick(self):
+        while self.callbacks:
+            self.callbacks.pop(0)()
+
+    def calls(self, name):
+        return self.artist.viewers[name].render.call_args_list
+
+    def test_events_in_one_tick_coalesced(self):
+        self.artist.on_field("air_temperature", 0, 0)
+        self.artist.on_visible({"a": [True]})
+        self.artist.on_field("air_temperature", 1, 0)
+        self.assertEqual(len(self.callbacks), 1)
+        self.tick()
+        self.assertEqual(self.calls("a"), [
+            unittest.mock.call("air_temperature", 1, 0)])
+
+    def test_schedules_again_after_render(self):
+        self.artist.on_visible({"a": [True]})
+        self.tick()
+        self.artist.on_field("air_temperature", 0, 0)
+        self.assertEqual(len(self.callbacks), 1)
+
+    def test_hidden_views_skipped(self):
+        self.artist.on_field("air_temperature", 0, 0)
+        self.artist.on_visible({"a": [False], "b": [True]})
+        self.tick()
+        self.assertEqual(self.calls("a"), [])
+        self.assertEqual(len(self.calls("b")), 1)
+        self.assertFalse(self.artist.renderers["a"][0].visible)
+
+    def test_up_to_date_views_skipped(self):
+        self.artist.on_field("air_temperature", 0, 0)
+        self.artist.on_visible({"a": [True]})
+        self.tick()
+        self.artist.on_visible({"a": [True], "b": [True]})
+        self.tick()
+        self.assertEqual(len(self.calls("a")), 1)
+        self.assertEqual(len(self.calls("b")), 1)
+        self.artist.on_field("air_temperature", 0, 1)
+        self.tick()
+        self.assertEqual(len(self.calls("a")), 2)
+
+    def test_failed_load_retried(self):
+        self.artist.on_field("air_temperature", 0, 0)
+        self.artist.on_visible({"a": [True]})
+        self.tick()
+        self.futures[0].set_exception(IOError("unreadable"))
+        self.tick()
+        self.artist.on_visible({"a": [True]})
+        self.tick()
+        self.assertEqual(len(self.calls("a")), 2)
+
+    def test_successful_load_not_repeated(self):
+        self.artist.on_field("air_temperature", 0, 0)
+        self.artist.on_visible({"a": [True]})
+        self.tick()
+        self.futures[0].set_result({})
+        self.tick()
+        self.artist.on_visible({"a": [True]})
+        self.tick()
+        self.assertEqual(len(self.calls("a")), 1)
+
+    def test_superseded_failure_keeps_newer_render(self):
+        self.artist.on_field("air_temperature", 0, 0)
+        self.artist.on_visible({"a": [True]})
+        self.tick()
+        self.artist.on_field("air_temperature", 0, 1)
+        self.tick()
+        self.futures[0].set_exception(IOError("unreadable"))
+        self.tick()
+        self.assertEqual(
+            self.artist.rendered["a"], ("air_temperature", 0, 1))
+
+    def test_hidden_views_leave_limits(self):
+        self.artist.on_field("relative_humidity", 0, 0)
+        self.artist.on_visible({"a": [True], "b": [True]})
+        self.tick()
+        self.artist.on_visible({"a": [True], "b": [False]})
+        self.artist.on_field("air_temperature", 0, 0)
+        self.tick()
+        mapper = self.artist.color_mapper
+        self.assertEqual((mapper.low, mapper.high), (250., 274.))
+
+    def test_shown_view_counts_again(self):
+        self.artist.on_field("relative_humidity", 0, 0)
+        self.artist.on_visible({"a": [True], "b": [False]})
+        self.tick()
+        self.artist.on_field("air_temperature", 0, 0)
+        self.tick()
+        self.artist.on_visible({"a": [False], "b": [True]})
+        self.tick()
+        self.artist.on_visible({"a": [True], "b": [True]})
+        self.tick()
+        self.assertEqual(len(self.calls("a")), 3)
+        mapper = self.artist.color_mapper
+        self.assertEqual((mapper.low, mapper.high), (250., 274.))
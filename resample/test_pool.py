@@ -0,0 +1,77 @@
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import netCDF4
+import pool
+
+
+def write(path, value):
+    with netCDF4.Dataset(path, "w") as dataset:
+        dataset.createDimension("x", 1)
+        dataset.createVariable("v", "f8", ("x",))[:] = value
+
+
+class TestDatasetPool(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.paths = [os.path.join(self.directory, "{}.nc".format(i))
+                      for i in range(3)]
+        for i, path in enumerate(self.paths):
+            write(path, i)
+        self.pool = pool.DatasetPool(max_open=2)
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.directory)
+
+    def test_repeat_reads_share_handle(self):
+        with self.pool.dataset(self.paths[0]) as first:
+            pass
+        with self.pool.dataset(self.paths[0]) as second:
+            self.assertIs(first, second)
+            self.assertTrue(second.isopen())
+
+    def test_least_recently_used_handle_closed(self):
+        handles = []
+        for path in self.paths:
+            with self.pool.dataset(path) as dataset:
+                handles.append(dataset)
+        self.assertEqual(len(self.pool), 2)
+        self.assertFalse(handles[0].isopen())
+        self.assertTrue(handles[2].isopen())
+
+    def test_modified_file_reopened(self):
+        with self.pool.dataset(self.paths[0]) as first:
+            pass
+        os.utime(self.paths[0], ns=(0, 0))
+        with self.pool.dataset(self.paths[0]) as second:
+            self.assertIsNot(first, second)
+            self.assertFalse(first.isopen())
+
+    def test_threads_never_use_netcdf_together(self):
+        inside = threading.Event()
+        leave = threading.Event()
+        entered = []
+
+        def hold():
+            with self.pool.dataset(self.paths[0]):
+                inside.set()
+                leave.wait(5)
+
+        def read():
+            with self.pool.dataset(self.paths[1]) as dataset:
+                entered.append(dataset.variables["v"][0])
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        inside.wait(5)
+        reader = threading.Thread(target=read)
+        reader.start()
+        reader.join(0.2)
+        self.assertEqual(entered, [])  # Blocked opening another file
+        leave.set()
+        holder.join(5)
+        reader.join(5)
+        self.assertEqual(entered, [1])
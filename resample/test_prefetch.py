@@ -0,0 +1,68 @@
+import unittest
+import threading
+import numpy as np
+import cache
+import prefetch
+
+
+class TestPrefetcher(unittest.TestCase):
+    def setUp(self):
+        self.loaded = []
+        self.done = threading.Event()
+        self.cache = cache.ImageCache(max_bytes=100)
+
+    def load(self, *key):
+        self.loaded.append(key)
+        if len(self.loaded) == self.expect:
+            self.done.set()
+
+    def test_prefetch_loads_indices(self):
+        self.expect = 2
+        prefetcher = prefetch.Prefetcher(self.load, self.cache)
+        prefetcher.prefetch("file.nc", "v", [(1, 0), (0, 1)])
+        self.done.wait(1)
+        self.assertEqual(self.loaded, [
+            ("file.nc", "v", 0, 1),
+            ("file.nc", "v", 1, 0)])
+
+    def test_prefetch_respects_memory_budget(self):
+        self.expect = 1
+        prefetcher = prefetch.Prefetcher(self.load, self.cache)
+        prefetcher.prefetch("file.nc", "v", [(1, 0)], nbytes=200)
+        prefetcher.prefetch("file.nc", "v", [(2, 0)], nbytes=10)
+        self.done.wait(1)
+        self.assertEqual(self.loaded, [("file.nc", "v", 0, 2)])
+
+    def test_prefetch_continues_once_cache_is_full(self):
+        self.expect = 1
+        self.cache["old"] = {"image": [np.zeros(100, dtype=np.uint8)]}
+        prefetcher = prefetch.Prefetcher(self.load, self.cache)
+        prefetcher.prefetch("file.nc", "v", [(1, 0)], nbytes=50)
+        self.done.wait(1)
+        self.assertEqual(self.loaded, [("file.nc", "v", 0, 1)])
+
+    def test_pinned_entries_limit_prefetch(self):
+        self.expect = 1
+        self.cache.pin("pinned")
+        self.cache["pinned"] = {"image": [np.zeros(80, dtype=np.uint8)]}
+        prefetcher = prefetch.Prefetcher(self.load, self.cache)
+        prefetcher.prefetch("file.nc", "v", [(1, 0)], nbytes=50)
+        prefetcher.prefetch("file.nc", "v", [(2, 0)], nbytes=10)
+        self.done.wait(1)
+        self.assertEqual(self.loaded, [("file.nc", "v", 0, 2)])
+
+    def test_new_variable_cancels_queued_keys(self):
+        self.expect = 2
+        release = threading.Event()
+
+        def load(*key):
+            release.wait(1)
+            self.load(*key)
+
+        prefetcher = prefetch.Prefetcher(load, self.cache)
+        prefetcher.prefetch("file.nc", "a", [(1, 0), (2, 0)])
+        prefetcher.prefetch("file.nc", "b", [(1, 0)])
+        release.set()
+        self.done.wait(1)
+        self.assertNotIn(("file.nc", "a", 0, 2), self.loaded)
+        self.assertEqual(self.loaded[-1], ("file.nc", "b", 0, 1))
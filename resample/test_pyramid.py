@@ -0,0 +1,39 @@
+import unittest
+import numpy as np
+import pyramid
+
+
+class TestPyramid(unittest.TestCase):
+    def setUp(self):
+        self.data = {
+            "x": [0.],
+            "y": [0.],
+            "dw": [300.],
+            "dh": [200.],
+            "image": [np.zeros((200, 300), dtype=np.float32)]
+        }
+
+    def test_downsample_ignores_nan(self):
+        image = np.array([[1., 2., 5.], [3., np.nan, np.nan]])
+        result = pyramid.downsample(image)
+        np.testing.assert_array_equal(result, [[2., 5.]])
+
+    def test_level_matches_screen_pixel(self):
+        self.assertEqual(pyramid.level(self.data, 0.5), 0)
+        self.assertEqual(pyramid.level(self.data, 3.), 1)
+        self.assertEqual(pyramid.level(self.data, 4.), 2)
+
+    def test_window_snapped_to_tiles(self):
+        window = pyramid.window(self.data, 0, (70., 10., 80., 20.))
+        self.assertEqual(window, (0, 64, 64, 128))
+
+    def test_window_clipped_to_image(self):
+        window = pyramid.window(self.data, 1, (-50., -50., 500., 500.))
+        self.assertEqual(window, (0, 100, 0, 150))
+
+    def test_crop_extent(self):
+        image = pyramid.downsample(self.data["image"][0])
+        result = pyramid.crop(self.data, image, 1, (0, 64, 64, 128))
+        self.assertEqual(result["x"], [128.])
+        self.assertEqual(result["dw"], [128.])
+        self.assertEqual(result["image"][0].shape, (64, 64))
@@ -0,0 +1,41 @@
+import unittest
+import os
+import shutil
+import tempfile
+import netCDF4
+import numpy as np
+import pool
+import sidecar
+
+
+class TestSeriesStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "file.nc")
+        self.values = np.arange(3 * 2 * 4 * 5, dtype="f").reshape(3, 2, 4, 5)
+        with netCDF4.Dataset(self.path, "w") as dataset:
+            for name, size in zip("tzyx", self.values.shape):
+                dataset.createDimension(name, size)
+            dataset.createVariable("v", "f4", ("t", "z", "y", "x"))[:] = self.values
+            dataset.createVariable("s", "f4", ("t", "y", "x"))[:] = self.values[:, 0]
+        self.datasets = pool.DatasetPool()
+        self.store = sidecar.SeriesStore(
+            os.path.join(self.directory, "series"), self.datasets)
+
+    def tearDown(self):
+        self.datasets.close()
+        shutil.rmtree(self.directory)
+
+    def test_get_before_build_returns_none(self):
+        self.assertIsNone(self.store.get(self.path, "v"))
+
+    def test_build_transposes_time_last(self):
+        self.store.build_async(self.path, "v").result()
+        result = self.store.get(self.path, "v")
+        self.assertEqual(result.shape, (2, 4, 5, 3))
+        np.testing.assert_array_equal(result[1, 2, 3], self.values[:, 1, 2, 3])
+
+    def test_build_three_dimensional_variable(self):
+        self.store.build(self.path, "s")
+        result = self.store.get(self.path, "s")
+        np.testing.assert_array_equal(result[2, 4], self.values[:, 0, 2, 4])
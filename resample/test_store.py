@@ -0,0 +1,65 @@
+import unittest
+import os
+import shutil
+import tempfile
+import netCDF4
+import numpy as np
+import store
+
+
+class TestChunkedStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "file.nc")
+        self.values = np.arange(3 * 2 * 4 * 5, dtype="f").reshape(3, 2, 4, 5)
+        with netCDF4.Dataset(self.path, "w") as dataset:
+            for name, size in zip(["time", "pressure", "latitude", "longitude"],
+                                  self.values.shape):
+                dataset.createDimension(name, size)
+            dataset.createVariable("latitude", "f4", ("latitude",))[:] = np.arange(4)
+            var = dataset.createVariable(
+                "v", "f4", ("time", "pressure", "latitude", "longitude"),
+                fill_value=-1.)
+            var.units = "K"
+            var[:] = np.ma.masked_equal(self.values, 0.)
+        self.store = store.ChunkedStore(os.path.join(self.directory, "store"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_get_before_write_returns_none(self):
+        self.assertIsNone(self.store.get(self.path, "v"))
+
+    def test_write_copies_values_with_nan_for_missing(self):
+        self.store.write(self.path, "v", zlib=True, chunk_bytes=64)
+        with netCDF4.Dataset(self.store.get(self.path, "v")) as dataset:
+            var = dataset.variables["v"]
+            result = np.ma.filled(var[:], np.nan)
+            self.assertEqual(var.units, "K")
+            self.assertEqual(var.chunking(), [2, 1, 2, 2])
+            self.assertTrue(var.filters()["zlib"])
+            np.testing.assert_array_equal(
+                dataset.variables["latitude"][:], np.arange(4))
+        expect = self.values.copy()
+        expect[0, 0, 0, 0] = np.nan
+        np.testing.assert_array_equal(result, expect)
+
+    def test_modified_source_not_matched(self):
+        self.store.write(self.path, "v")
+        os.utime(self.path, ns=(0, 0))
+        self.assertIsNone(self.store.get(self.path, "v"))
+
+
+class TestChunkShape(unittest.TestCase):
+    def test_balances_slice_and_series_reads(self):
+        self.assertEqual(
+            store.chunk_shape((64, 1000, 1000), 4, 2**20), (4, 256, 256))
+
+    def test_one_level_per_chunk(self):
+        self.assertEqual(
+            store.chunk_shape((64, 10, 1000, 1000), 4, 2**20),
+            (4, 1, 256, 256))
+
+    def test_chunks_never_exceed_shape(self):
+        self.assertEqual(
+            store.chunk_shape((2, 3, 10, 20), 4, 2**20), (2, 1, 10, 20))
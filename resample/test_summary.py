@@ -0,0 +1,36 @@
+import unittest
+import numpy as np
+import cache
+import summary
+
+
+class TestSummary(unittest.TestCase):
+    def setUp(self):
+        image = np.arange(100, dtype=np.float32).reshape(10, 10)
+        image[0, 0] = np.nan
+        image[9, 9] = 1e6  # Outlier
+        self.image = image
+
+    def test_summarise(self):
+        result = summary.summarise([self.image])
+        self.assertEqual(result["min"], 1.)
+        self.assertEqual(result["max"], 1e6)
+        self.assertEqual(result["nan_count"], 1)
+        self.assertAlmostEqual(result["percentiles"][5], 5.9, places=5)
+
+    def test_percentiles_ignore_outlier(self):
+        result = summary.summarise([self.image])
+        low, high = summary.limits([result], 2, 98)
+        self.assertAlmostEqual(low, 2.96, places=5)
+        self.assertAlmostEqual(high, 97.04, places=5)
+        self.assertEqual(summary.limits([result]), (1., 1e6))
+
+    def test_no_finite_values(self):
+        self.assertIsNone(summary.summarise([np.full(4, np.nan)]))
+        self.assertIsNone(summary.limits([None]))
+
+    def test_cached_alongside_image(self):
+        images = cache.ImageCache()
+        images["k"] = {"image": [self.image]}
+        first = summary.cached(images, "k", [self.image])
+        self.assertIs(summary.cached(images, "k", None), first)
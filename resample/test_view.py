@@ -0,0 +1,110 @@
+import unittest
+import unittest.mock
+from concurrent.futures import Future
+import numpy as np
+import bokeh.models
+import bokeh.plotting
+import view
+import geo
+
+
+class TestLonLatBox(unittest.TestCase):
+    def test_zoomed_out_view_covers_globe(self):
+        half = geo.WORLD_WIDTH / 2.
+        self.assertEqual(
+            view.lon_lat_box(-2 * half, -2 * half, 2 * half, 2 * half),
+            (-180., -90., 180., 90.))
+
+    def test_view_inside_world(self):
+        lon0, lat0, lon1, lat1 = view.lon_lat_box(0, 0, 1e6, 1e6)
+        self.assertEqual((lon0, lat0), (0., 0.))
+        self.assertAlmostEqual(lon1, 8.983, places=3)
+        self.assertLess(lon0, lon1)
+
+
+class TestViewport(unittest.TestCase):
+    def setUp(self):
+        self.figure = bokeh.plotting.figure(
+                plot_width=100,
+                x_range=(0, 1000),
+                y_range=(0, 500))
+        self.viewport = view.Viewport(delay=10)
+        self.views = []
+        self.viewport.subscribe(lambda *args: self.views.append(args))
+
+    def test_update_announces_bbox_and_pixel(self):
+        self.viewport.add_figure(self.figure)
+        self.viewport.update()
+        self.assertEqual(self.views, [((0, 0, 1000, 500), 10.)])
+
+    def test_only_first_figure_watched(self):
+        self.viewport.add_figure(self.figure)
+        self.viewport.add_figure(bokeh.plotting.figure())
+        self.assertIs(self.viewport.figure, self.figure)
+
+    def test_range_changes_debounced(self):
+        document = bokeh.plotting.curdoc()
+        self.viewport.add_figure(self.figure)
+        with unittest.mock.patch.object(
+                document, "add_timeout_callback") as add, \
+                unittest.mock.patch.object(
+                    document, "remove_timeout_callback") as remove:
+            self.figure.x_range.start = 100
+            self.figure.x_range.end = 900
+        self.assertEqual(add.call_count, 2)
+        remove.assert_called_once_with(add.return_value)
+        self.assertEqual(self.views, [])
+
+
+class TestGPMView(unittest.TestCase):
+    def setUp(self):
+        self.loader = unittest.mock.Mock()
+        self.loader.find.return_value = 3
+        self.loader.key.side_effect = lambda i: ("gpm.nc", "p", 0, i)
+        self.future = Future()
+        self.loader.image_async.return_value = self.future
+        self.view = view.GPMView(
+                self.loader, bokeh.models.LinearColorMapper())
+        self.image = {
+            "x": [0], "y": [0], "dw": [1], "dh": [1],
+            "image": [np.ones((2, 2), dtype="f")]}
+
+    def test_other_variables_empty(self):
+        self.assertIsNone(self.view.render("air_temperature", "valid"))
+        self.loader.image_async.assert_not_called()
+        self.assertEqual(self.view.source.data["image"], [])
+
+    def test_no_record_near_valid_time_empty(self):
+        self.loader.find.return_value = None
+        self.assertIsNone(self.view.render("precipitation_flux", "valid"))
+        self.loader.find.assert_called_once_with("valid")
+        self.assertEqual(self.view.source.data["image"], [])
+
+    def test_record_loaded_on_next_tick(self):
+        document = unittest.mock.Mock()
+        with unittest.mock.patch(
+                "bokeh.plotting.curdoc", return_value=document):
+            future = self.view.render("precipitation_flux", "valid")
+        self.assertIs(future, self.future)
+        self.loader.image_async.assert_called_once_with(3)
+        self.future.set_result(self.image)
+        self.assertEqual(self.view.source.data["image"], [])
+        callback, = document.add_next_tick_callback.call_args[0]
+        callback()
+        self.assertEqual(len(self.view.source.data["image"]), 1)
+
+    def test_cached_record_set_immediately(self):
+        self.future.set_result(self.image)
+        self.view.render("precipitation_flux", "valid")
+        self.assertEqual(len(self.view.source.data["image"]), 1)
+
+    def test_superseded_record_dropped(self):
+        document = unittest.mock.Mock()
+        with unittest.mock.patch(
+                "bokeh.plotting.curdoc", return_value=document):
+            self.view.render("precipitation_flux", "valid")
+        self.view.render("air_temperature", "valid")
+        self.future.set_result(self.image)
+        callback, = document.add_next_tick_callback.call_args[0]
+        callback()
+        self.assertEqual(self.view.source.data["image"], [])
@@ -1,4 +1,5 @@
 from functools import partial
+from concurrent.futures import Future
 
 
 class Observable(object):
@@ -25,3 +26,16 @@ def select(dropdown):
             if value == new:
                 dropdown.label = label
     return wrapped
+
+
+def chain(future, fn):
+    """Future of fn applied to the result of another future"""
+    chained = Future()
+
+    def callback(done):
+        try:
+            chained.set_result(fn(done.result()))
+        except Exception as e:
+            chained.set_exception(e)
+    future.add_done_callback(callback)
+    return chained
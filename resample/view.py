@@ -1,60 +1,228 @@
+import bokeh.colors
 import bokeh.models
+import bokeh.plotting
+import numpy as np
 import geo
+import encoding
+import pyramid
+import summary
+from functools import partial
+from util import Observable
+
+
+class Viewport(Observable):
+    """Debounced web mercator view of a figure
+
+    Figures share ranges, so only the first figure added is
+    watched. Once range changes settle for ``delay`` milliseconds
+    listeners receive the view's (x0, y0, x1, y1) and the width
+    of a screen pixel in metres
+    """
+    def __init__(self, delay=200):
+        super().__init__()
+        self.delay = delay
+        self.figure = None
+        self.timeout = None
+
+    def add_figure(self, figure):
+        if self.figure is not None:
+            return
+        self.figure = figure
+        for axis_range in [figure.x_range, figure.y_range]:
+            axis_range.on_change("start", self.on_range)
+            axis_range.on_change("end", self.on_range)
+
+    def on_range(self, attr, old, new):
+        document = bokeh.plotting.curdoc()
+        if self.timeout is not None:
+            try:
+                document.remove_timeout_callback(self.timeout)
+            except ValueError:
+                pass  # Already fired
+        self.timeout = document.add_timeout_callback(
+                self.update, self.delay)
+
+    def update(self):
+        """Announce the current view unless ranges are unset"""
+        self.timeout = None
+        view = self.current()
+        if view is not None:
+            self.announce(*view)
+
+    def current(self):
+        figure = self.figure
+        if figure is None:
+            return None
+        x_range, y_range = figure.x_range, figure.y_range
+        if None in (x_range.start, x_range.end, y_range.start, y_range.end):
+            return None
+        x0, x1 = sorted([x_range.start, x_range.end])
+        y0, y1 = sorted([y_range.start, y_range.end])
+        width = getattr(figure, "inner_width", None) or figure.plot_width
+        return (x0, y0, x1, y1), (x1 - x0) / width
 
 
 class EarthNetworks(object):
-    def __init__(self, loader):
-        frame = loader.frame
-        if frame is not None:
-            x, y = geo.web_mercator(
-                    frame.longitude,
-                    frame.latitude)
-            date = frame.date
-            longitude = frame.longitude
-            latitude = frame.latitude
-            flash_type = frame.flash_type
-        else:
-            x, y = [], []
-            date = []
-            longitude = []
-            latitude = []
-            flash_type = []
-        self.source = bokeh.models.ColumnDataSource({
+    """Lightning flashes, aggregated into counts when zoomed out
+
+    Once more than ``threshold`` flashes are visible they are
+    binned into cells roughly ``cell_pixels`` screen pixels wide
+    and one circle per cell is drawn, sized by its count. Range
+    changes are debounced before re-rendering
+    """
+    def __init__(self, loader, threshold=5000, cell_pixels=8, delay=200):
+        self.loader = loader
+        self.threshold = threshold
+        self.cell_pixels = cell_pixels
+        self.viewport = Viewport(delay)
+        self.viewport.subscribe(self.render)
+        self.mode = None
+        self.source = bokeh.models.ColumnDataSource(
+                self.columns([], [], 10, []))
+
+    @staticmethod
+    def columns(x, y, size, count, flashes=None):
+        n = len(x)
+        if flashes is None:
+            flashes = {
+                "date": np.full(n, np.datetime64("NaT"), dtype="datetime64[ns]"),
+                "longitude": np.full(n, np.nan),
+                "latitude": np.full(n, np.nan),
+                "flash_type": np.full(n, "", dtype=object)}
+        columns = {
             "x": x,
             "y": y,
-            "date": date,
-            "longitude": longitude,
-            "latitude": latitude,
-            "flash_type": flash_type,
-        })
+            "size": np.broadcast_to(size, (n,)).copy(),
+            "count": count}
+        columns.update(flashes)
+        return columns
+
+    def render(self, bbox, pixel):
+        x0, y0, x1, y1 = bbox
+        bbox = lon_lat_box(x0, y0, x1, y1)
+        if self.loader.count(bbox=bbox) <= self.threshold:
+            flashes = self.loader.query(bbox=bbox)
+            count = len(flashes["date"])
+            x, y = geo.web_mercator(
+                    flashes["longitude"],
+                    flashes["latitude"])
+            self.mode = "flashes"
+            self.source.data = self.columns(
+                    x, y, 10, np.ones(count, dtype=int), flashes)
+            return
+
+        # Aggregate into cells about cell_pixels wide
+        level = int(np.floor(np.log2(
+            geo.WORLD_WIDTH / (self.cell_pixels * pixel))))
+        level = max(level, 0)
+        x, y, counts = self.loader.aggregate(level)
+        visible = (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)
+        x, y, counts = x[visible], y[visible], counts[visible]
+        size = 2 + self.cell_pixels * np.sqrt(counts / counts.max(initial=1))
+        self.mode = "aggregate"
+        self.source.data = self.columns(x, y, size, counts)
 
     def add_figure(self, figure):
         renderer = figure.circle(
                 x="x",
                 y="y",
-                size=10,
+                size="size",
                 source=self.source)
         tool = bokeh.models.HoverTool(
                 tooltips=[
                     ('Time', '@date{%F}'),
                     ('Lon', '@longitude'),
                     ('Lat', '@latitude'),
-                    ('Flash type', '@flash_type')],
+                    ('Flash type', '@flash_type'),
+                    ('Count', '@count')],
                 formatters={
                     'date': 'datetime'
                 },
                 renderers=[renderer])
         figure.add_tools(tool)
+        if self.viewport.figure is None:
+            self.viewport.add_figure(figure)
+            self.viewport.update()
+        return renderer
+
+
+def lon_lat_box(x0, y0, x1, y1):
+    """Longitude/latitude box of a web mercator view
+
+    Views are clipped to the world first, so that zooming out
+    beyond the dateline never wraps into an inverted box
+    """
+    half = geo.WORLD_WIDTH / 2.
+    (lon0, lon1), (lat0, lat1) = geo.plate_carree(
+            np.clip([x0, x1], -half, half),
+            np.clip([y0, y1], -half, half))
+    if x0 <= -half:
+        lon0 = -180.
+    if x1 >= half:
+        lon1 = 180.
+    if y0 <= -half:
+        lat0 = -90.
+    if y1 >= half:
+        lat1 = 90.
+    return lon0, lat0, lon1, lat1
+
+
+class Lines(object):
+    """Coastlines or borders simplified to suit the zoom level
+
+    One source is shared by every figure. On range changes, which
+    are debounced, lines are re-sent only if the level of detail
+    changes or the view leaves the padded extent sent last time
+    """
+    def __init__(self, lines, delay=200):
+        self.lines = lines
+        self.viewport = Viewport(delay)
+        self.viewport.subscribe(self.render)
+        self.level = None
+        self.extent = None
+        self.source = bokeh.models.ColumnDataSource({
+            "xs": [],
+            "ys": []})
+
+    def render(self, bbox, pixel):
+        x0, y0, x1, y1 = bbox
+        level = self.lines.level(pixel)
+        if (level is self.level) and self.contains(x0, y0, x1, y1):
+            return
+        dx, dy = (x1 - x0) / 2., (y1 - y0) / 2.
+        self.level = level
+        self.extent = (x0 - dx, y0 - dy, x1 + dx, y1 + dy)
+        self.source.data = level.query(self.extent)
+
+    def contains(self, x0, y0, x1, y1):
+        if self.extent is None:
+            return False
+        ex0, ey0, ex1, ey1 = self.extent
+        return (ex0 <= x0) and (x1 <= ex1) and (ey0 <= y0) and (y1 <= ey1)
+
+    def add_figure(self, figure):
+        renderer = figure.multi_line(
+                xs="xs",
+                ys="ys",
+                source=self.source,
+                color="white")
+        self.viewport.add_figure(figure)
         return renderer
 
 
 class RDT(object):
     def __init__(self, loader):
+        self.loader = loader
         self.color_mapper = bokeh.models.CategoricalColorMapper(
                 palette=bokeh.palettes.Spectral6,
                 factors=["0", "1", "2", "3", "4"])
         self.source = bokeh.models.GeoJSONDataSource(
-                geojson=loader.geojson)
+                geojson=loader.geojson())
+
+    def render(self, valid):
+        geojson = self.loader.geojson(valid)
+        if geojson != self.source.geojson:
+            self.source.geojson = geojson
 
     def add_figure(self, figure):
         renderer = figure.patches(
@@ -98,59 +266,300 @@ class RDT(object):
         return renderer
 
 
+class Encoder(Observable):
+    """Encode images into a source for transfer to the browser
+
+    Quantised images are drawn through a code space copy of the
+    colour mapper. The NaN sentinel lies above its high and is drawn
+    in the nan_color. In rgba mode images are coloured on the server.
+    Images are re-encoded once per tick when the shared mapper changes
+
+    Given a cache and key, encodings are kept alongside the raw image,
+    so documents showing the same image, window and mapper state
+    share one encoding rather than each computing their own
+
+    A summary of each new image, kept alongside it in the cache, is
+    announced before it is encoded, so auto-ranging applies to the
+    first encoding
+
+    Given a viewport, only a tile-snapped window of the pyramid
+    level nearest screen resolution is sent. Levels are kept with
+    the raw image. A window is re-sent only if the level changes or
+    the viewport leaves it
+
+    :param mode: float32, uint8, uint16 or rgba
+    :param cache: optional ImageCache holding the raw images
+    """
+    def __init__(self, source, color_mapper, mode="float32", cache=None):
+        super().__init__()
+        self.source = source
+        self.color_mapper = color_mapper
+        self.mode = mode
+        self.cache = cache
+        self.raw = None
+        self.key = None
+        self.state = None
+        self.pending = False
+        self.viewport = None
+        self.window = None
+        self.levels = {}
+        if mode in ("float32", "rgba"):
+            self.mapper = color_mapper
+        else:
+            self.mapper = bokeh.models.LinearColorMapper(
+                    palette=color_mapper.palette,
+                    low=0,
+                    high=encoding.sentinel(mode) - 1,
+                    high_color=color_mapper.nan_color,
+                    nan_color=color_mapper.nan_color)
+        if mode != "float32":
+            color_mapper.on_change("palette", self.on_change)
+            color_mapper.on_change("low", self.on_change)
+            color_mapper.on_change("high", self.on_change)
+
+    def set(self, data, key=None):
+        """Encode new raw data
+
+        :param key: cache key of the raw image
+        """
+        self.raw = data
+        self.key = key
+        self.window = None
+        self.levels = {}
+        self.announce(summary.cached(self.cache, key, data["image"]))
+        self.encode()
+
+    def hide(self):
+        """Withdraw the announced summary while no figure shows it"""
+        self.announce(None)
+
+    def zoom(self, bbox, pixel):
+        """Follow a web mercator viewport
+
+        :param bbox: (x0, y0, x1, y1) of the viewport
+        :param pixel: width of a screen pixel in metres
+        """
+        self.viewport = (bbox, pixel)
+        if self.raw is None:
+            return
+        if self.find_window() != self.window:
+            self.encode()
+
+    def find_window(self):
+        """Pyramid level and window to send, None for everything"""
+        if (self.viewport is None) or (len(self.raw["image"]) == 0):
+            return None
+        (x0, y0, x1, y1), pixel = self.viewport
+        level = pyramid.level(self.raw, pixel)
+        visible = pyramid.window(self.raw, level, (x0, y0, x1, y1))
+        if (self.window is not None) and (self.window[0] == level):
+            if pyramid.contains(self.window[1], visible):
+                return self.window
+        dx, dy = (x1 - x0) / 2., (y1 - y0) / 2.
+        return level, pyramid.window(
+                self.raw, level, (x0 - dx, y0 - dy, x1 + dx, y1 + dy))
+
+    def windowed(self):
+        if self.window is None:
+            return self.raw
+        level, window = self.window
+        return pyramid.crop(self.raw, self.level(level), level, window)
+
+    def level(self, level):
+        """Image at a pyramid level, built from the level above"""
+        if level == 0:
+            return self.raw["image"][0]
+        if (self.cache is None) or (self.key is None):
+            if level not in self.levels:
+                self.levels[level] = pyramid.downsample(self.level(level - 1))
+            return self.levels[level]
+        return self.cache.derive(
+                self.key,
+                ("pyramid", level),
+                lambda: {"image": [
+                    pyramid.downsample(self.level(level - 1))]})["image"][0]
+
+    def current(self):
+        """Mapper state an encoding depends on"""
+        if self.mode == "float32":
+            return None
+        low, high = self.color_mapper.low, self.color_mapper.high
+        if self.mode == "rgba":
+            return (tuple(self.color_mapper.palette),
+                    self.color_mapper.nan_color, low, high)
+        return (low, high)
+
+    def encode(self):
+        self.state = self.current()
+        self.window = self.find_window()
+        if self.mode not in ("float32", "rgba"):
+            if list(self.mapper.palette) != list(self.color_mapper.palette):
+                self.mapper.palette = self.color_mapper.palette
+        if (self.cache is None) or (self.key is None):
+            self.source.data = self.encoded()
+        elif (self.mode == "float32") and (self.window is None):
+            # Raw images are sent as they are, there is nothing to share
+            self.source.data = self.encoded()
+        else:
+            name = ("encoded", self.mode, self.state, self.window)
+            self.source.data = self.cache.derive(self.key, name, self.encoded)
+
+    def encoded(self):
+        """Current window encoded with the current mapper state"""
+        data = self.windowed()
+        if self.mode == "float32":
+            return encoding.encode(data)
+        if self.mode != "rgba":
+            return encoding.encode(data, self.mode, *self.state)
+        palette, nan_color, low, high = self.state
+        lut = encoding.lut(palette, rgba(nan_color))
+        return encoding.encode(data, "rgba", low, high, lut)
+
+    def on_change(self, attr, old, new):
+        if self.pending:
+            return
+        self.pending = True
+        bokeh.plotting.curdoc().add_next_tick_callback(self.reencode)
+
+    def reencode(self):
+        self.pending = False
+        if self.raw is None:
+            return
+        if self.current() != self.state:
+            self.encode()
+
+    def add_figure(self, figure):
+        if self.mode == "rgba":
+            return figure.image_rgba(
+                    x="x",
+                    y="y",
+                    dw="dw",
+                    dh="dh",
+                    image="image",
+                    source=self.source)
+        return figure.image(
+                x="x",
+                y="y",
+                dw="dw",
+                dh="dh",
+                image="image",
+                source=self.source,
+                color_mapper=self.mapper)
+
+    def tooltip(self):
+        """Hover tooltips and formatters showing physical values"""
+        if self.mode == "float32":
+            return [("Value", "@image")], {}
+        if self.mode == "rgba":
+            return [], {}
+        formatter = bokeh.models.CustomJSHover(
+                args=dict(source=self.source),
+                code="""
+                if (value == {sentinel}) {{
+                    return "NaN"
+                }}
+                var data = source.data
+                return String(data.offset[0] + data.scale[0] * value)
+                """.format(sentinel=encoding.sentinel(self.mode)))
+        return [("Value", "@image{custom}")], {"image": formatter}
+
+
+def rgba(color):
+    """Packed uint32 of a named or "#rrggbb" colour, else transparent"""
+    named = getattr(bokeh.colors.named, str(color), None)
+    if named is not None:
+        color = named.to_hex()
+    if isinstance(color, str) and color.startswith("#") and len(color) == 7:
+        return int(encoding.pack([color])[0])
+    return 0
+
+
 class UMView(object):
-    def __init__(self, loader, color_mapper):
+    """Model fields, optionally resampled to the visible viewport
+
+    :param viewport: send only what the first figure shows, at
+                     about screen resolution
+    :param delay: milliseconds to debounce range changes
+    """
+    def __init__(self, loader, color_mapper, encoding="float32", cache=None,
+                 viewport=False, delay=200):
         self.loader = loader
         self.color_mapper = color_mapper
+        self.pending = None
         self.source = bokeh.models.ColumnDataSource({
                 "x": [],
                 "y": [],
                 "dw": [],
                 "dh": [],
                 "image": []})
+        self.encoder = Encoder(self.source, color_mapper, encoding, cache)
+        self.viewport = None
+        if viewport:
+            self.viewport = Viewport(delay)
+            self.viewport.subscribe(self.encoder.zoom)
 
     def render(self, variable, ipressure, itime):
+        """Load an image without blocking the document
+
+        Slow reads run on the shared executor and are applied on
+        the next tick, results for superseded fields are dropped
+
+        :returns: future of the image or None
+        """
         if variable is None:
-            return
-        self.source.data = self.loader.image(
-                variable,
-                ipressure,
-                itime)
+            return None
+        key = (variable, ipressure, itime)
+        self.pending = key
+        future = self.loader.image_async(*key)
+        if future.done():
+            self.on_load(key, future)
+        else:
+            document = bokeh.plotting.curdoc()
+            future.add_done_callback(
+                lambda f: document.add_next_tick_callback(
+                    partial(self.on_load, key, f)))
 
         def on_change(attr, old, new):
             print(attr, old, new)
 
         self.source.selected.on_change("indices",
                 on_change)
+        return future
+
+    def on_load(self, key, future):
+        if key != self.pending:
+            return
+        try:
+            data = future.result()
+            cache_key = self.loader.key(*key)
+        except Exception as e:
+            print("failed to load: {} {}".format(key, e))
+            return
+        self.encoder.set(data, cache_key)
 
     def add_figure(self, figure):
-        renderer = figure.image(
-                x="x",
-                y="y",
-                dw="dw",
-                dh="dh",
-                image="image",
-                source=self.source,
-                color_mapper=self.color_mapper)
+        renderer = self.encoder.add_figure(figure)
+        values, formatters = self.encoder.tooltip()
         tool = bokeh.models.HoverTool(
                 renderers=[renderer],
-                tooltips=[
-                    ("Name", "@name"),
-                    ("Value", "@image"),
+                tooltips=[("Name", "@name")] + values + [
                     ('Length', '@length'),
                     ('Valid', '@valid{%F %H:%M}'),
                     ('Initial', '@initial{%F %H:%M}'),
                     ("Level", "@level")],
-                formatters={
+                formatters=dict(formatters, **{
                     'valid': 'datetime',
                     'initial': 'datetime'
-                })
+                }))
         figure.add_tools(tool)
+        if (self.viewport is not None) and (self.viewport.figure is None):
+            self.viewport.add_figure(figure)
+            self.viewport.update()
         return renderer
 
 
 class GPMView(object):
-    def __init__(self, loader, color_mapper):
+    def __init__(self, loader, color_mapper, encoding="float32", cache=None):
         self.loader = loader
         self.color_mapper = color_mapper
         self.empty = {
@@ -161,20 +570,46 @@ class GPMView(object):
                 "dw": [],
                 "dh": [],
                 "image": []}
+        self.pending = None
         self.source = bokeh.models.ColumnDataSource(self.empty)
+        self.encoder = Encoder(self.source, color_mapper, encoding, cache)
 
-    def render(self, variable, ipressure, itime):
-        if variable != "precipitation_flux":
-            self.source.data = self.empty
+    def render(self, variable, valid):
+        """Load the record covering a validity time without blocking
+
+        Records are shown with precipitation fields only, reads are
+        applied on the next tick like UMView
+
+        :returns: future of the image or None if nothing is shown
+        """
+        itime = None
+        if variable == "precipitation_flux":
+            itime = self.loader.find(valid)
+        if itime is None:
+            self.pending = None
+            self.encoder.set(self.empty)
+            return None
+        key = self.loader.key(itime)
+        self.pending = key
+        future = self.loader.image_async(itime)
+        if future.done():
+            self.on_load(key, future)
         else:
-            self.source.data = self.loader.image(itime)
+            document = bokeh.plotting.curdoc()
+            future.add_done_callback(
+                lambda f: document.add_next_tick_callback(
+                    partial(self.on_load, key, f)))
+        return future
+
+    def on_load(self, key, future):
+        if key != self.pending:
+            return
+        try:
+            data = future.result()
+        except Exception as e:
+            print("failed to load: {} {}".format(key, e))
+            return
+        self.encoder.set(data, key)
 
     def add_figure(self, figure):
-        return figure.image(
-                x="x",
-                y="y",
-                dw="dw",
-                dh="dh",
-                image="image",
-                source=self.source,
-                color_mapper=self.color_mapper)
+        return self.encoder.add_figure(figure)